@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本仓库产物的本地优先读取
+
+merge_dd.py / merge_ff.py 需要的 BB.m3u、EE.m3u、TW.m3u 就在当前检出的仓库里，
+直接读本地文件，避免经 raw.githubusercontent.com 绕一圈（还可能拿到 CDN 旧缓存）。
+本地文件不存在、为空或太旧（按修改时间判断）时才回退到网络下载。
+
+产物写入用 write_atomic()：先写同目录下的临时文件再替换，读的一方不会看到写了一半的文件。
+"""
+
+import os
+import time
+import tempfile
+from urllib.parse import unquote
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+# 指向本仓库的远程地址前缀
+REPO_RAW_PREFIXES = [
+    "https://raw.githubusercontent.com/sufernnet/joker/main/",
+    "https://raw.githubusercontent.com/sufernnet/joker/refs/heads/main/",
+]
+
+# 本地文件超过这个时间（秒）没有更新就认为过期，可用环境变量 ARTEFACT_MAX_AGE 调整
+MAX_AGE = int(os.environ.get("ARTEFACT_MAX_AGE", 12 * 3600))
+
+
+def local_path_for(url):
+    """远程地址对应的本地路径，不是本仓库的地址返回 None"""
+    for prefix in REPO_RAW_PREFIXES:
+        if url.startswith(prefix):
+            rel = unquote(url[len(prefix):].split("?", 1)[0])
+            path = os.path.normpath(os.path.join(ROOT_DIR, rel))
+            if path.startswith(ROOT_DIR + os.sep):
+                return path
+    return None
+
+
+def read_fresh_local(url, max_age=None):
+    """本地文件存在、非空且足够新时返回内容，否则返回 None"""
+    path = local_path_for(url)
+    if not path or not os.path.isfile(path):
+        return None
+
+    max_age = MAX_AGE if max_age is None else max_age
+    age = time.time() - os.path.getmtime(path)
+    if age > max_age:
+        print(f"本地文件已过期 ({age / 3600:.1f}h): {path}")
+        return None
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+    except Exception as e:
+        print(f"读取本地文件失败: {path} ({e})")
+        return None
+
+    if not content.strip():
+        return None
+    print(f"使用本地文件: {os.path.relpath(path, ROOT_DIR)}")
+    return content
+
+
+def resolve_artefact(url, download, *args, **kwargs):
+    """优先用本地文件，否则调用 download(url, *args, **kwargs)"""
+    content = read_fresh_local(url)
+    if content is not None:
+        return content
+    return download(url, *args, **kwargs)
+
+
+def write_atomic(path, content):
+    """写到同目录的临时文件后 os.replace 覆盖原文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
@@ -4,11 +4,14 @@ import requests
 import yaml
 import time
 import os
-import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
 import logging
 
+from source_loader import load_sources
+from playlist_stream import load_channels
+from prober import sticky_many
+import m3u_parser
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class LiveStreamFetcher:
@@ -23,187 +26,42 @@ class LiveStreamFetcher:
         self.session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'})
         self.channels = {}
         self.output_path = os.path.join(script_dir, '..', 'auto.m3u')
-        self.cache_path = os.path.join(script_dir, 'speed_cache.json')
-        # 加载速度缓存
-        self.speed_cache = self.load_cache()
-
-    def load_cache(self):
-        """加载速度缓存"""
-        if os.path.exists(self.cache_path):
-            try:
-                with open(self.cache_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
-
-    def save_cache(self):
-        """保存速度缓存"""
-        # 只保留最近7天的记录
-        current_time = time.time()
-        filtered_cache = {}
-        for url, data in self.speed_cache.items():
-            if current_time - data.get('timestamp', 0) < 7 * 24 * 3600:
-                filtered_cache[url] = data
-        with open(self.cache_path, 'w', encoding='utf-8') as f:
-            json.dump(filtered_cache, f, ensure_ascii=False, indent=2)
-
-    def fetch_m3u_content(self, url):
-        """获取单个订阅源内容"""
-        try:
-            resp = self.session.get(url, timeout=15)
-            resp.encoding = 'utf-8'
-            if resp.status_code == 200:
-                return resp.text
-        except Exception as e:
-            logging.error(f"获取失败 {url}: {e}")
-        return None
-
-    def parse_m3u(self, content):
-        """解析M3U内容，返回频道列表 [(name, url)]"""
-        channels = []
-        lines = content.split('\n')
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith('#EXTINF:'):
-                # 提取频道名
-                match = re.search(r',(.+)$', line)
-                if match:
-                    name = match.group(1).strip()
-                    # 下一行是URL
-                    if i + 1 < len(lines):
-                        url = lines[i+1].strip()
-                        if url and not url.startswith('#') and url.startswith(('http', 'https', 'rtmp', 'rtsp')):
-                            channels.append((name, url))
-                    i += 2
-                else:
-                    i += 1
-            else:
-                i += 1
-        return channels
-
-    def parse_m3u_with_group(self, content):
-        """解析M3U内容，返回带分组信息的频道列表 [(group, name, url)]"""
-        channels = []
-        lines = content.split('\n')
-        current_group = ''
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith('#EXTINF:'):
-                # 提取分组和频道名
-                group_match = re.search(r'group-title="([^"]+)"', line)
-                if group_match:
-                    current_group = group_match.group(1)
-                match = re.search(r',(.+)$', line)
-                if match:
-                    name = match.group(1).strip()
-                    if i + 1 < len(lines):
-                        url = lines[i+1].strip()
-                        if url and not url.startswith('#') and url.startswith(('http', 'https', 'rtmp', 'rtsp')):
-                            channels.append((current_group, name, url))
-                    i += 2
-                else:
-                    i += 1
-            else:
-                i += 1
-        return channels
-
-    def quick_check_url(self, url):
-        """快速检查URL是否有效（不测试速度）"""
-        # 检查缓存
-        if url in self.speed_cache:
-            cache_data = self.speed_cache[url]
-            # 如果缓存时间在24小时内，直接使用
-            if time.time() - cache_data.get('timestamp', 0) < 86400:
-                return cache_data.get('delay', None)
-        # 快速检查：只检查HTTP状态码
-        try:
-            resp = self.session.head(url, timeout=3, allow_redirects=True)
-            if resp.status_code < 400:
-                # 简单测试一下速度（只测试一次）
-                start = time.time()
-                resp = self.session.get(url, timeout=3, stream=True)
-                if resp.status_code < 400:
-                    for chunk in resp.iter_content(512):
-                        break
-                    delay = time.time() - start
-                    resp.close()
-                    # 缓存结果
-                    self.speed_cache[url] = {'delay': delay, 'timestamp': time.time()}
-                    return delay
-        except:
-            pass
-        return None
-
-    def test_url_speed(self, url):
-        """测试URL速度，返回延迟(秒)或None"""
-        # 检查缓存
-        if url in self.speed_cache:
-            cache_data = self.speed_cache[url]
-            # 如果缓存时间在24小时内，直接使用
-            if time.time() - cache_data.get('timestamp', 0) < 86400:
-                return cache_data.get('delay', None)
-        try:
-            start = time.time()
-            # 使用GET获取前几个字节
-            resp = self.session.get(url, timeout=5, stream=True)
-            if resp.status_code < 400:
-                for chunk in resp.iter_content(1024):
-                    break
-                delay = time.time() - start
-                resp.close()
-                # 缓存结果
-                self.speed_cache[url] = {'delay': delay, 'timestamp': time.time()}
-                return delay
-        except:
-            pass
-        return None
-
-    def select_best_url(self, urls):
-        """从多个URL中选择速度最快的（智能策略）"""
-        if not urls:
-            return None
-        if len(urls) == 1:
-            return urls[0]
-        # 先快速检查所有URL
-        valid_urls = []
-        for url in urls:
-            delay = self.quick_check_url(url)
-            if delay is not None:
-                valid_urls.append((url, delay))
-        if not valid_urls:
-            return urls[0]
-        # 按速度排序
-        valid_urls.sort(key=lambda x: x[1])
-        return valid_urls[0][0]
+
+    def fetch_channels(self, url):
+        """流式获取并解析单个 M3U 订阅源，返回 [(group, name, url)]（同一 URL 本次运行只下载一次）"""
+        records = load_channels(url, m3u_parser.STREAM_SCHEMES, retry=1)
+        return [(c.group, c.name, c.url) for c in records if c.extinf and c.name]
+
+    def select_best_urls(self, multi_source):
+        """多源频道选最优地址：先验证上次选中的地址，健康就沿用，其余频道所有候选一起抢答"""
+        best = {}
+        for name, (url, _) in sticky_many("auto", multi_source).items():
+            best[name] = url or multi_source[name][0]
+        return best
 
     def process_sources(self):
         """处理所有订阅源（优化版：不测试单源频道）"""
         all_raw_channels = []  # (name, url)
         hk_tw_channels = []  # 存储港澳台分组的频道
 
-        # 第一步：收集所有频道
-        for url in self.config['extra_urls']:
-            logging.info(f"处理订阅源: {url}")
-            content = self.fetch_m3u_content(url)
-            if content:
-                # 特殊处理包含港澳台分组的源
-                if 'codeberg.org' in url:
-                    channels_with_group = self.parse_m3u_with_group(content)
-                    for group, name, channel_url in channels_with_group:
-                        if group == '🔮港澳台直播':
-                            hk_tw_channels.append((name, channel_url))
-                        else:
-                            all_raw_channels.append((name, channel_url))
-                    logging.info(f" 获取到 {len(channels_with_group)} 个频道（含分组）")
+        # 第一步：并发收集所有频道（下载完成即解析，结果按配置顺序合并）
+        def parse_source(url, channels):
+            # 特殊处理包含港澳台分组的源
+            if 'codeberg.org' in url:
+                logging.info(f"处理订阅源: {url} 获取到 {len(channels)} 个频道（含分组）")
+                return channels
+            logging.info(f"处理订阅源: {url} 获取到 {len(channels)} 个频道")
+            return [(None, name, channel_url) for _, name, channel_url in channels]
+
+        for url, channels in load_sources(self.config['extra_urls'], self.fetch_channels, parse_source):
+            if channels is None:
+                logging.warning(f"处理订阅源: {url} 获取失败")
+                continue
+            for group, name, channel_url in channels:
+                if group == '🔮港澳台直播':
+                    hk_tw_channels.append((name, channel_url))
                 else:
-                    channels = self.parse_m3u(content)
-                    all_raw_channels.extend(channels)
-                    logging.info(f" 获取到 {len(channels)} 个频道")
-            else:
-                logging.warning(f" 获取失败")
+                    all_raw_channels.append((name, channel_url))
 
         # 第二步：按频道名分组URL
         channel_urls = {}
@@ -230,23 +88,10 @@ class LiveStreamFetcher:
         for name, url in single_source.items():
             self.channels[name] = url
 
-        # 多源频道进行测速（并发处理）
+        # 多源频道进行测速（热启动 + 抢答模式，所有频道一次提交）
         if multi_source:
             logging.info("开始测试多源频道速度...")
-            tested = 0
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                future_to_name = {}
-                for name, urls in multi_source.items():
-                    future = executor.submit(self.select_best_url, urls)
-                    future_to_name[future] = name
-                for future in as_completed(future_to_name):
-                    name = future_to_name[future]
-                    best_url = future.result()
-                    if best_url:
-                        self.channels[name] = best_url
-                        tested += 1
-                        if tested % 50 == 0:
-                            logging.info(f"已测试 {tested}/{len(multi_source)} 个多源频道")
+            self.channels.update(self.select_best_urls(multi_source))
 
         # 处理港澳台频道的分组信息
         for name, url in hk_tw_channels:
@@ -257,7 +102,6 @@ class LiveStreamFetcher:
             self.hk_tw_sources[clean_name] = url
 
         logging.info(f"最终获得 {len(self.channels)} 个有效频道")
-        self.save_cache()  # 保存缓存
 
     def classify_channels(self):
         """分类频道到不同分组"""
@@ -277,9 +121,8 @@ class LiveStreamFetcher:
 
         try:
             logging.info(f"从 {cctv_source_url} 获取央视频道...")
-            content = self.fetch_m3u_content(cctv_source_url)
-            if content:
-                channels_with_group = self.parse_m3u_with_group(content)
+            channels_with_group = self.fetch_channels(cctv_source_url)
+            if channels_with_group:
                 for group, name, url in channels_with_group:
                     if group == "央视卫视":
                         clean_name = re.sub(r'[\[\(].*?[\]\)]', '', name).strip()
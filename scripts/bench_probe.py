@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测速阶段的基准测试（不访问外网）
+
+用 fake_origin 在本机起一组假源站：每个频道若干候选，随机混入快/中/慢、限速、403/404、
+分片 403、挂起、重定向以及 rtsp/rtmp 地址（正常、DESCRIBE 404、拒绝握手、挂起），
+候选分布在多个回环地址上（每个地址算一个主机）。然后依次跑：
+
+- pick_best_many：全部候选测完再按排名选
+- race_best_many：抢答模式
+- sticky（冷启动 / 热启动）：第二次运行只验证上次选中的地址
+- new.py test_stream：HLS 严格可播 + 吞吐余量判断（只测 http 候选）
+- stream_probes：rtsp/rtmp 协议探测的判断准确率
+
+每一项输出墙钟时间、测速地址数 / 秒、假源站收到的请求数和选源准确率。
+测速记录写到临时文件，有效期设为 0（每一项都真的测），不影响 scripts/probe_store.sqlite。
+
+用法：python scripts/bench_probe.py [--channels 30] [--hosts 8] [--seed 1] [--no-politeness] [--json 结果文件]
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+# 必须在导入 probe_store 之前设置；atexit 后进先出，临时目录在 STORE 关闭之后才删
+_STORE_DIR = tempfile.mkdtemp(prefix="bench-probe-")
+atexit.register(shutil.rmtree, _STORE_DIR, True)
+os.environ["PROBE_STORE"] = os.path.join(_STORE_DIR, "probe_store.sqlite")
+os.environ["PROBE_TTL"] = "0"
+os.environ["PROBE_FAIL_TTL"] = "0"
+
+import aiohttp
+
+import rate_limit
+from fake_origin import FakeOrigin, loopback
+from prober import ProbeEngine, best_ranked
+from rate_limit import scheduler
+from new import test_stream, MIN_HEADROOM
+from stream_probes import probe_stream
+
+# 候选类型 -> (假源站配置, 响应头正常, 分片可播, 吞吐足够)
+ROLES = {
+    "fast": ({"latency": 0.03}, True, True, True),
+    "medium": ({"latency": 0.15}, True, True, True),
+    "slow": ({"latency": 0.6}, True, True, True),
+    "throttled": ({"latency": 0.05, "bandwidth": 48 * 1024}, True, True, False),
+    "forbidden": ({"status": 403}, False, False, False),
+    "missing": ({"status": 404}, False, False, False),
+    "segment_forbidden": ({"latency": 0.05, "segment_status": 403}, True, False, False),
+    "hang": ({"hang": True}, False, False, False),
+    "redirect": ({}, True, True, True),
+    "rtsp": ({"protocol": "rtsp", "latency": 0.04}, True, True, True),
+    "rtsp_missing": ({"protocol": "rtsp", "status": 404}, False, False, False),
+    "rtsp_hang": ({"protocol": "rtsp", "hang": True}, False, False, False),
+    "rtmp": ({"protocol": "rtmp", "latency": 0.08}, True, True, True),
+    "rtmp_refused": ({"protocol": "rtmp", "status": 503}, False, False, False),
+}
+# RTSP 探测要走 OPTIONS + DESCRIBE 两个来回，测出的延迟是单次的两倍
+ROUND_TRIPS = {"rtsp": 2}
+HEALTHY = ("fast", "medium", "slow")
+CANDIDATES_PER_CHANNEL = (3, 6)
+# 单独测 rtsp/rtmp 时的超时（秒），挂起的候选靠它判失败
+PROTOCOL_TIMEOUT = 2
+
+
+def build_scenario(channels, hosts, seed):
+    """返回 (streams 配置, {频道: [候选信息]})，每个频道至少有一个完全健康的候选"""
+    rng = random.Random(seed)
+    streams, plan = {}, {}
+    for c in range(channels):
+        roles = [rng.choice(HEALTHY)]
+        roles += rng.choices(list(ROLES), k=rng.randint(*CANDIDATES_PER_CHANNEL) - 1)
+        rng.shuffle(roles)
+        entries = []
+        for i, role in enumerate(roles):
+            name = f"c{c}-{i}-{role}"
+            cfg, header_ok, playable, smooth = ROLES[role]
+            cfg = dict(cfg, host=rng.randrange(hosts))
+            if "latency" in cfg:
+                # 错开一点，避免并列
+                cfg["latency"] += rng.uniform(0, 0.01)
+            latency = cfg.get("latency", 0.0) * ROUND_TRIPS.get(cfg.get("protocol"), 1)
+            if role == "redirect":
+                target = f"c{c}-{i}-redirect-target"
+                streams[target] = {"latency": 0.15 + rng.uniform(0, 0.01), "host": rng.randrange(hosts)}
+                cfg["redirect"] = target
+                latency = streams[target]["latency"]
+            streams[name] = cfg
+            entries.append({
+                "name": name, "role": role, "latency": latency, "protocol": cfg.get("protocol", "http"),
+                "header_ok": header_ok, "playable": playable, "smooth": smooth,
+            })
+        plan[c] = entries
+    return streams, plan
+
+
+def expected_best(entries):
+    """只看响应头的测速应该选中的候选：响应头正常的里面延迟最小的"""
+    ok = [e for e in entries if e["header_ok"]]
+    return min(ok, key=lambda e: e["latency"])["name"]
+
+
+def selection_stats(plan, chosen, by_url):
+    """(选中预期最优的比例, 选中的地址真正可播的比例)"""
+    hit = playable = 0
+    for c, entries in plan.items():
+        e = by_url.get(chosen.get(c))
+        if e is None:
+            continue
+        hit += e["name"] == expected_best(entries)
+        playable += e["playable"]
+    return hit / len(plan), playable / len(plan)
+
+
+class Bench:
+    def __init__(self, origin, plan, per_host):
+        self.origin = origin
+        self.plan = plan
+        self.per_host = per_host
+        self.urls = {c: [origin.url(e["name"]) for e in entries] for c, entries in plan.items()}
+        self.by_url = {origin.url(e["name"]): e for entries in plan.values() for e in entries}
+        self.results = []
+
+    def record(self, stage, elapsed, probes, accuracy=None, playable=None, **extra):
+        row = {
+            "stage": stage,
+            "seconds": round(elapsed, 3),
+            "probes": probes,
+            "probes_per_sec": round(probes / elapsed, 1) if elapsed else None,
+            "requests": self.origin.total_hits(),
+            "accuracy": None if accuracy is None else round(accuracy, 3),
+            "playable": None if playable is None else round(playable, 3),
+        }
+        row.update(extra)
+        self.results.append(row)
+        self.origin.reset_hits()
+        return row
+
+    def run_engine(self, stage, fn):
+        engine = ProbeEngine(per_host=self.per_host)
+        self.origin.reset_hits()
+        start = time.time()
+        try:
+            chosen = fn(engine)
+        finally:
+            elapsed = time.time() - start
+            engine.close()
+        probes = len(engine._results)
+        accuracy, playable = selection_stats(self.plan, chosen, self.by_url)
+        return self.record(stage, elapsed, probes, accuracy, playable)
+
+    def pick_best(self, engine):
+        latencies = engine.probe_many(u for urls in self.urls.values() for u in urls)
+        return {c: best_ranked(urls, latencies) for c, urls in self.urls.items()}
+
+    def race(self, engine):
+        return {c: url for c, (url, _) in engine.race_many(self.urls).items()}
+
+    def sticky(self, engine):
+        return {c: url for c, (url, _) in engine.sticky_many("bench", self.urls).items()}
+
+    async def _streams(self, urls):
+        async def one(session, url):
+            async with scheduler().slot(url):
+                return await test_stream(session, url)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=45)) as session:
+            return await asyncio.gather(*(one(session, u) for u in urls))
+
+    def streams(self):
+        urls = [u for u, e in self.by_url.items() if e["protocol"] == "http"]
+        self.origin.reset_hits()
+        start = time.time()
+        results = asyncio.run(self._streams(urls))
+        elapsed = time.time() - start
+        strict_hit = headroom_hit = headroom_total = 0
+        for url, (strict_ok, _, _, headroom, _) in zip(urls, results):
+            e = self.by_url[url]
+            strict_hit += strict_ok == e["playable"]
+            if e["playable"] and headroom is not None:
+                headroom_total += 1
+                headroom_hit += (headroom >= MIN_HEADROOM) == e["smooth"]
+        return self.record(
+            "new.test_stream", elapsed, len(urls),
+            strict_accuracy=round(strict_hit / len(urls), 3),
+            headroom_accuracy=round(headroom_hit / headroom_total, 3) if headroom_total else None,
+        )
+
+    async def _protocols(self, urls):
+        return await asyncio.gather(*(probe_stream(u, PROTOCOL_TIMEOUT) for u in urls))
+
+    def protocols(self):
+        urls = [u for u, e in self.by_url.items() if e["protocol"] != "http"]
+        if not urls:
+            return None
+        self.origin.reset_hits()
+        start = time.time()
+        results = asyncio.run(self._protocols(urls))
+        elapsed = time.time() - start
+        hit = sum((latency is not None) == self.by_url[u]["header_ok"] for u, (latency, _) in zip(urls, results))
+        return self.record("stream_probes", elapsed, len(urls), accuracy=hit / len(urls))
+
+    def run(self):
+        self.run_engine("pick_best_many", self.pick_best)
+        self.run_engine("race_best_many", self.race)
+        self.run_engine("sticky (冷启动)", self.sticky)
+        self.run_engine("sticky (热启动)", self.sticky)
+        self.streams()
+        self.protocols()
+        return self.results
+
+
+def print_table(results):
+    print(f"{'阶段':<18}{'耗时(s)':>9}{'测速数':>8}{'测速/s':>9}{'请求数':>8}{'准确率':>8}{'可播率':>8}")
+    for r in results:
+        acc = "-" if r["accuracy"] is None else f"{r['accuracy']:.0%}"
+        play = "-" if r["playable"] is None else f"{r['playable']:.0%}"
+        print(f"{r['stage']:<18}{r['seconds']:>9.2f}{r['probes']:>8}{r['probes_per_sec'] or 0:>9.1f}"
+              f"{r['requests']:>8}{acc:>8}{play:>8}")
+    for r in results:
+        if "strict_accuracy" in r:
+            headroom = "-" if r["headroom_accuracy"] is None else f"{r['headroom_accuracy']:.0%}"
+            print(f"{r['stage']}: 严格可播判断准确率 {r['strict_accuracy']:.0%}，吞吐余量判断准确率 {headroom}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测速阶段基准测试（本地假源站）")
+    parser.add_argument("--channels", type=int, default=30)
+    parser.add_argument("--hosts", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-politeness", action="store_true", help="放开单主机限速和并发上限")
+    parser.add_argument("--json", help="结果另存为 JSON")
+    args = parser.parse_args(argv)
+
+    per_host = rate_limit.HOST_CONCURRENCY
+    if args.no_politeness:
+        per_host = rate_limit.MAX_CONCURRENCY
+        for i in range(args.hosts):
+            rate_limit.HOST_OVERRIDES[loopback(i)] = (1000.0, 1000)
+
+    streams, plan = build_scenario(args.channels, args.hosts, args.seed)
+    origin = FakeOrigin(streams, hosts=args.hosts).start_in_background()
+    try:
+        print(f"频道 {len(plan)} 个，候选 {sum(len(e) for e in plan.values())} 个，主机 {args.hosts} 个")
+        results = Bench(origin, plan, per_host).run()
+    finally:
+        origin.close()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
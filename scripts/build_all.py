@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+一次运行生成全部播放列表
+
+把 merge_ee / joker / merge_ff / merge_dd / new / auto / xnkl 作为依赖图里的阶段，
+在同一个进程里执行：所有阶段共用 single_flight 的下载缓存和测速结果表，
+重叠的上游（yang.sufern001.workers.dev、EXTRA_URLS、BB.m3u 等）只下载一次，
+同一播放地址只测速一次。
+
+用法：
+    python scripts/build_all.py            # 生成全部
+    python scripts/build_all.py DD new     # 只生成指定阶段（自动带上依赖）
+"""
+
+import os
+import sys
+import time
+import asyncio
+import importlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+# 同时执行的阶段数
+MAX_PARALLEL_STAGES = 4
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
+
+
+# ===================== 阶段 =====================
+
+def run_ee():
+    importlib.import_module("merge_ee").main()
+
+def run_joker():
+    importlib.import_module("joker").main()
+
+def run_gather():
+    importlib.import_module("merge_ff").main()
+
+def run_dd():
+    importlib.import_module("merge_dd").main()
+
+def run_new():
+    new = importlib.import_module("new")
+    channels = asyncio.run(new.fetch_best_channels())
+    new.generate_output(channels, new.OUTPUT_FILE)
+
+def run_auto():
+    importlib.import_module("auto").LiveStreamFetcher().run()
+
+def run_xnkl():
+    return importlib.import_module("xnkl").main()
+
+
+# 名称 -> (依赖, 执行函数, 输出文件)
+STAGES = {
+    "EE":     ([],     run_ee,     "EE.m3u"),
+    "joker":  ([],     run_joker,  "joker.m3u"),
+    "Gather": ([],     run_gather, "Gather.m3u"),
+    "DD":     (["EE"], run_dd,     "DD.m3u"),
+    "new":    ([],     run_new,    "new.m3u"),
+    "auto":   ([],     run_auto,   "auto.m3u"),
+    "xnkl":   ([],     run_xnkl,   "xnkl.m3u"),
+}
+
+
+def resolve(names):
+    """展开依赖，返回需要执行的阶段集合"""
+    need = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name not in STAGES:
+            raise KeyError(f"未知阶段: {name}（可选: {', '.join(STAGES)}）")
+        if name in need:
+            continue
+        need.add(name)
+        stack.extend(STAGES[name][0])
+    return need
+
+
+def output_mtime(output):
+    path = os.path.join(ROOT_DIR, output)
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def run_stage(name):
+    deps, func, output = STAGES[name]
+    start = time.time()
+    before = output_mtime(output)
+    log(f"▶ 开始 {name}")
+    try:
+        code = func()
+    except SystemExit as e:
+        code = e.code
+    if code not in (None, 0):
+        raise RuntimeError(f"{name} 返回 {code}")
+    # 有的脚本下载失败只打印一行就返回，输出文件没有重写就算失败，下游不能用旧文件
+    if output_mtime(output) in (None, before):
+        raise RuntimeError(f"{name} 没有生成 {output}")
+    log(f"✔ 完成 {name} -> {output} ({time.time() - start:.1f}s)")
+
+
+def run_graph(names):
+    """按依赖顺序执行阶段，互不依赖的阶段并行；失败阶段的下游全部跳过"""
+    need = resolve(names)
+    done, failed = set(), set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_STAGES) as ex:
+        while need or running:
+            for name in sorted(need):
+                deps = STAGES[name][0]
+                if any(d in failed for d in deps):
+                    log(f"⏭ 跳过 {name}（依赖失败）")
+                    need.discard(name)
+                    failed.add(name)
+                elif all(d in done for d in deps):
+                    need.discard(name)
+                    running[ex.submit(run_stage, name)] = name
+
+            if not running:
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for f in finished:
+                name = running.pop(f)
+                try:
+                    f.result()
+                    done.add(name)
+                except Exception as e:
+                    log(f"❌ {name} 失败: {e}")
+                    failed.add(name)
+
+    return done, failed
+
+
+def main():
+    os.chdir(ROOT_DIR)
+    names = sys.argv[1:] or list(STAGES)
+    start = time.time()
+
+    try:
+        done, failed = run_graph(names)
+    except KeyError as e:
+        log(f"❌ {e.args[0]}")
+        return 2
+
+    log("=" * 50)
+    for name in STAGES:
+        if name in done:
+            log(f"  ✅ {STAGES[name][2]}")
+        elif name in failed:
+            log(f"  ❌ {STAGES[name][2]}")
+    log(f"总耗时: {time.time() - start:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+录制 / 回放上游响应（离线、可重复的端到端计时和性能分析）
+
+各脚本直接访问公网源，端到端耗时随网络波动，离线也跑不起来。这里在进程内替换网络层：
+
+- record：照常访问网络，把所有响应（状态码、响应头、调用方实际读到的正文、响应头到达的耗时）
+  以及 TCP 预检、rtsp/rtmp 探测的结果录进一个 gzip 压缩的 JSON 文件（cassette）
+- replay：完全不访问网络，同样的请求按录制顺序返回录下的响应（同一请求多次出现时依次返回，
+  用完后重复最后一次），默认按录制的耗时等待，没录到的请求当作连接失败
+
+替换的位置：requests 的 HTTPAdapter.send、aiohttp 的 ClientSession._request、
+reachability._connect 和 stream_probes.PROTOCOL_PROBES，脚本本身不用改。
+
+测速记录（probe_store）和主机健康记录（host_health）录制和回放时都换成临时文件、从空状态开始，
+测速记录有效期设为 0：两次运行做的是同样的请求，不受真实记录里的缓存、上次选中的地址和熔断状态影响，
+回放里没录到的请求也不会让真实的主机健康记录熔断。录下来的是一次冷启动。
+
+用法：
+  python scripts/cassette.py record run.json.gz scripts/build_all.py
+  python scripts/cassette.py replay run.json.gz [--speed 0] [--profile run.prof] scripts/build_all.py new
+  python scripts/cassette.py record epg.json.gz scripts/merge_epg.py
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import atexit
+import base64
+import runpy
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+
+# 必须在各脚本导入 probe_store / host_health 之前设置；atexit 后进先出，临时目录最后删
+_STATE_DIR = tempfile.mkdtemp(prefix="cassette-")
+atexit.register(shutil.rmtree, _STATE_DIR, True)
+os.environ["PROBE_STORE"] = os.path.join(_STATE_DIR, "probe_store.sqlite")
+os.environ["HEALTH_FILE"] = os.path.join(_STATE_DIR, "host_health.json")
+os.environ["PROBE_TTL"] = "0"
+os.environ["PROBE_FAIL_TTL"] = "0"
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+import reachability
+import stream_probes
+
+FORMAT_VERSION = 1
+# 影响响应内容的请求头，参与匹配
+KEY_HEADERS = ("range",)
+
+
+class Cassette:
+    """一盘录像：http 请求按 (方法, URL, 关键请求头) 分组，每组按发生顺序保存"""
+
+    def __init__(self, path, mode, speed=1.0):
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.entries = {"http": {}, "tcp": {}, "stream": {}}
+        self.misses = 0
+        self._cursor = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.load()
+
+    # ---------- 文件 ----------
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"不支持的录像版本: {data.get('version')}")
+        for kind in self.entries:
+            self.entries[kind] = data.get(kind, {})
+
+    def save(self):
+        with self._lock:
+            data = {"version": FORMAT_VERSION, "recorded_at": time.time(), **self.entries}
+            with gzip.open(self.path, "wt", encoding="utf-8") as f:
+                # 录制中的 aiohttp 正文是 bytearray，保存时才编码
+                json.dump(data, f, ensure_ascii=False, default=lambda o: encode_body(bytes(o)))
+
+    # ---------- 录制 / 取出 ----------
+
+    def add(self, kind, key, record):
+        with self._lock:
+            self.entries[kind].setdefault(key, []).append(record)
+        return record
+
+    def next(self, kind, key):
+        """按顺序取出下一条录制结果，用完后重复最后一条；没录到返回 None"""
+        with self._lock:
+            records = self.entries[kind].get(key)
+            if not records:
+                self.misses += 1
+                return None
+            i = self._cursor.get((kind, key), 0)
+            self._cursor[(kind, key)] = i + 1
+            return records[min(i, len(records) - 1)]
+
+    def delay(self, record):
+        return record.get("latency", 0) * self.speed
+
+
+def http_key(method, url, headers):
+    extra = "".join(f"|{h}={headers[h]}" for h in KEY_HEADERS if headers and headers.get(h))
+    return f"{method.upper()} {url}{extra}"
+
+
+def encode_body(body):
+    return base64.b64encode(body).decode("ascii")
+
+
+def decode_body(record):
+    body = record.get("body", "")
+    return bytes(body) if isinstance(body, bytearray) else base64.b64decode(body)
+
+
+CASSETTE = None
+
+
+# ===================== requests =====================
+
+_adapter_send = HTTPAdapter.send
+
+
+def _requests_response(adapter, request, record):
+    r = requests.Response()
+    r.status_code = record["status"]
+    r.reason = record.get("reason", "")
+    r.headers = CaseInsensitiveDict(record["headers"])
+    r.encoding = get_encoding_from_headers(r.headers)
+    r.raw = io.BytesIO(decode_body(record))
+    r.url = record.get("url", request.url)
+    r.request = request
+    r.connection = adapter
+    return r
+
+
+def _requests_error(record):
+    if record["error"] == "timeout":
+        return requests.exceptions.Timeout("回放: 录制时超时")
+    return requests.exceptions.ConnectionError(f"回放: {record['error']}")
+
+
+def adapter_send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+    key = http_key(request.method, request.url, request.headers)
+    if CASSETTE.mode == "replay":
+        record = CASSETTE.next("http", key)
+        if record is None:
+            raise requests.exceptions.ConnectionError(f"回放: 没有录到 {key}")
+        time.sleep(CASSETTE.delay(record))
+        if "error" in record:
+            raise _requests_error(record)
+        return _requests_response(self, request, record)
+
+    start = time.time()
+    try:
+        r = _adapter_send(self, request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+    except requests.exceptions.Timeout:
+        CASSETTE.add("http", key, {"error": "timeout", "latency": time.time() - start})
+        raise
+    except requests.exceptions.RequestException as e:
+        CASSETTE.add("http", key, {"error": type(e).__name__, "latency": time.time() - start})
+        raise
+    latency = time.time() - start
+    # requests 这边都是有限长度的下载（播放列表、EPG），直接读完
+    body = r.content
+    record = CASSETTE.add("http", key, {
+        "status": r.status_code, "reason": r.reason, "headers": dict(r.headers), "url": r.url,
+        "latency": latency, "body": encode_body(body),
+    })
+    return _requests_response(self, request, record)
+
+
+# ===================== aiohttp =====================
+
+_session_request = aiohttp.ClientSession._request
+
+
+class _Body:
+    """aiohttp StreamReader 里脚本用到的那部分接口，数据来自内存"""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def at_eof(self):
+        return self._pos >= len(self._data)
+
+    async def read(self, n=-1):
+        end = len(self._data) if n < 0 else self._pos + n
+        chunk = self._data[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
+    async def readany(self):
+        return await self.read(64 * 1024)
+
+    async def readline(self):
+        i = self._data.find(b"\n", self._pos)
+        return await self.read(-1 if i < 0 else i + 1 - self._pos)
+
+    async def iter_chunked(self, n):
+        while True:
+            chunk = await self.read(n)
+            if not chunk:
+                return
+            yield chunk
+
+    async def iter_any(self):
+        while True:
+            chunk = await self.readany()
+            if not chunk:
+                return
+            yield chunk
+
+    def __aiter__(self):
+        return self._lines()
+
+    async def _lines(self):
+        while not self.at_eof():
+            yield await self.readline()
+
+
+class _TeeBody(_Body):
+    """录制用：从真实响应读，读到的每一段同时记进录像"""
+
+    def __init__(self, content, record):
+        self._content = content
+        self._body = record["body"]
+
+    def _keep(self, chunk):
+        self._body += chunk
+        return chunk
+
+    def at_eof(self):
+        return self._content.at_eof()
+
+    async def read(self, n=-1):
+        return self._keep(await self._content.read(n))
+
+    async def readany(self):
+        return self._keep(await self._content.readany())
+
+    async def readline(self):
+        return self._keep(await self._content.readline())
+
+
+class ReplayResponse:
+    """ClientResponse 里脚本用到的那部分接口"""
+
+    def __init__(self, method, url, record, content, real=None):
+        self.method = method
+        self.status = record["status"]
+        self.reason = record.get("reason", "")
+        self.headers = CIMultiDictProxy(CIMultiDict(record["headers"]))
+        self.url = URL(record.get("url", url))
+        self.content = content
+        self._real = real
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    @property
+    def content_length(self):
+        value = self.headers.get("Content-Length")
+        return int(value) if value and value.isdigit() else None
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status, message=self.reason)
+
+    async def read(self):
+        return await self.content.read()
+
+    async def text(self, encoding=None, errors="strict"):
+        return (await self.read()).decode(encoding or "utf-8", errors)
+
+    def release(self):
+        if self._real is not None:
+            self._real.release()
+
+    def close(self):
+        if self._real is not None:
+            self._real.close()
+
+    async def wait_for_close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+def _aiohttp_error(record):
+    # 录制时被调用方取消（抢答模式里输掉的探测）的请求，回放时没被取消就按超时处理
+    if record["error"] in ("timeout", "cancelled"):
+        return asyncio.TimeoutError()
+    return aiohttp.ClientConnectionError(f"回放: {record['error']}")
+
+
+async def session_request(self, method, str_or_url, **kwargs):
+    url = str(URL(str_or_url))
+    key = http_key(method, url, CIMultiDict(kwargs.get("headers") or {}))
+    if CASSETTE.mode == "replay":
+        record = CASSETTE.next("http", key)
+        if record is None:
+            raise aiohttp.ClientConnectionError(f"回放: 没有录到 {key}")
+        await asyncio.sleep(CASSETTE.delay(record))
+        if "error" in record:
+            raise _aiohttp_error(record)
+        return ReplayResponse(method, url, record, _Body(decode_body(record)))
+
+    start = time.time()
+    try:
+        r = await _session_request(self, method, str_or_url, **kwargs)
+    except asyncio.CancelledError:
+        CASSETTE.add("http", key, {"error": "cancelled", "latency": time.time() - start})
+        raise
+    except asyncio.TimeoutError:
+        CASSETTE.add("http", key, {"error": "timeout", "latency": time.time() - start})
+        raise
+    except aiohttp.ClientError as e:
+        CASSETTE.add("http", key, {"error": type(e).__name__, "latency": time.time() - start})
+        raise
+    # 正文按调用方实际读到的记录：测速只读响应头或前几 MB，直播流不会被整段读下来
+    record = CASSETTE.add("http", key, {
+        "status": r.status, "reason": r.reason, "headers": dict(r.headers), "url": str(r.url),
+        "latency": time.time() - start, "body": bytearray(),
+    })
+    return ReplayResponse(method, url, record, _TeeBody(r.content, record), real=r)
+
+
+# ===================== TCP 预检 / rtsp / rtmp =====================
+
+_connect = reachability._connect
+
+
+async def connect(host, port, timeout):
+    key = f"{host}:{port}"
+    if CASSETTE.mode == "replay":
+        record = CASSETTE.next("tcp", key)
+        if record is None:
+            return False
+        await asyncio.sleep(CASSETTE.delay(record))
+        return record["ok"]
+    start = time.time()
+    ok = await _connect(host, port, timeout)
+    CASSETTE.add("tcp", key, {"ok": ok, "latency": time.time() - start})
+    return ok
+
+
+def _stream_probe(probe):
+    async def wrapper(url):
+        if CASSETTE.mode == "replay":
+            record = CASSETTE.next("stream", url)
+            if record is None:
+                raise ConnectionError(f"回放: 没有录到 {url}")
+            await asyncio.sleep(CASSETTE.delay(record))
+            if "error" in record:
+                raise ConnectionError(f"回放: {record['error']}")
+            return record["result"], record["status"]
+        start = time.time()
+        try:
+            result, status = await probe(url)
+        except asyncio.CancelledError:
+            # probe_stream 的超时
+            CASSETTE.add("stream", url, {"error": "timeout", "latency": time.time() - start})
+            raise
+        except Exception as e:
+            CASSETTE.add("stream", url, {"error": type(e).__name__, "latency": time.time() - start})
+            raise
+        CASSETTE.add("stream", url, {"result": result, "status": status, "latency": time.time() - start})
+        return result, status
+    return wrapper
+
+
+def install(cassette):
+    global CASSETTE
+    CASSETTE = cassette
+    HTTPAdapter.send = adapter_send
+    aiohttp.ClientSession._request = session_request
+    reachability._connect = connect
+    for scheme, probe in list(stream_probes.PROTOCOL_PROBES.items()):
+        stream_probes.PROTOCOL_PROBES[scheme] = _stream_probe(probe)
+
+
+# ===================== 入口 =====================
+
+def run_script(script, args, profile=None):
+    sys.argv = [script] + args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    if profile is None:
+        runpy.run_path(script, run_name="__main__")
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(runpy.run_path, script, run_name="__main__")
+    finally:
+        profiler.dump_stats(profile)
+        print(f"性能分析结果: {profile}（python -m pstats {profile}）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="录制 / 回放上游响应")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("cassette", help="录像文件（gzip JSON）")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放时按录制耗时的倍数等待，0 为不等待")
+    parser.add_argument("--profile", help="用 cProfile 运行，结果写到这个文件")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    cassette = Cassette(args.cassette, args.mode, args.speed)
+    install(cassette)
+    start = time.time()
+    code = 0
+    try:
+        run_script(args.script, args.args, args.profile)
+    except SystemExit as e:
+        code = e.code
+    finally:
+        elapsed = time.time() - start
+        if args.mode == "record":
+            cassette.save()
+            total = sum(len(v) for kind in cassette.entries.values() for v in kind.values())
+            print(f"已录制 {total} 条响应: {args.cassette}")
+        else:
+            print(f"回放完成，未命中 {cassette.misses} 个请求")
+        print(f"总耗时: {elapsed:.2f} 秒")
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
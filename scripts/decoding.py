@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应内容解码
+
+服务器不带 charset 时 requests 的 r.text 会用 charset_normalizer / chardet 扫描整个响应体猜编码，
+几 MB 的播放列表要花不少时间。这里直接处理原始字节：先看 BOM，再严格按 UTF-8 解码，
+只有失败时才依次尝试 GB18030、Big5，绝大多数（UTF-8）列表完全不经过编码探测。
+"""
+
+import codecs
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# UTF-8 解码失败时依次尝试的编码
+FALLBACK_ENCODINGS = ("gb18030", "big5")
+
+
+def guess_fallback(raw):
+    """返回第一个能完整解码 raw 的备选编码，都不行时返回 utf-8（配合 errors="replace" 使用）"""
+    for enc in FALLBACK_ENCODINGS:
+        try:
+            raw.decode(enc)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return "utf-8"
+
+
+def decode_bytes(raw):
+    """BOM -> 严格 UTF-8 -> GB18030 / Big5，最后兜底为 UTF-8 替换非法字节"""
+    if not raw:
+        return ""
+    for bom, enc in BOMS:
+        if raw.startswith(bom):
+            return raw.decode(enc, errors="replace")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    return raw.decode(guess_fallback(raw), errors="replace")
+
+
+def response_text(r):
+    """代替 requests 的 r.text，不触发编码探测"""
+    return decode_bytes(r.content)
+
+
+class LineDecoder:
+    """
+    流式逐行解码，每个响应一个实例
+
+    第一行去掉 UTF-8 BOM；默认严格按 UTF-8 解码，遇到第一行解不了的内容后
+    换成能解码该行的备选编码，并在这个响应剩下的行里一直沿用。
+    """
+
+    def __init__(self):
+        self.encoding = None
+        self._first = True
+
+    def __call__(self, raw):
+        if self._first:
+            self._first = False
+            if raw.startswith(codecs.BOM_UTF8):
+                raw = raw[len(codecs.BOM_UTF8):]
+        if self.encoding is None:
+            try:
+                return raw.decode("utf-8")
+            except UnicodeDecodeError:
+                self.encoding = guess_fallback(raw)
+        return raw.decode(self.encoding, errors="replace")
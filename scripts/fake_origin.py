@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地假 HLS / IPTV 源站（测速基准用，见 bench_probe.py）
+
+每个流按配置模拟：响应延迟、限速、403/404、挂起不响应、重定向、多码率主播放列表。
+分片内容按 content 种子确定性生成，content 相同的流分片字节完全一样（模拟转发同一上游的镜像）。
+可以同时绑定多个回环地址（127.0.0.1、127.0.0.2 …），每个地址在测速调度里算一个独立主机。
+
+地址结构（name 为流名）：
+  /name/index.m3u8          有 variants 时是主播放列表，否则直接是媒体播放列表
+  /name/b<码率>/media.m3u8  媒体播放列表
+  /name/b<码率>/seg<n>.ts   分片
+  /name/live                持续输出的裸流（非 m3u8 地址的测速）
+
+protocol 为 rtsp / rtmp 的流（stream_probes 的探测对象）：
+  rtsp://主机:端口/name        每个回环地址一个 RTSP 端口，应答 OPTIONS / DESCRIBE，
+                               DESCRIBE 返回 status（200 时带 SDP）
+  rtmp://主机:端口/live/name   RTMP 握手里没有流名，每个流单独一个端口；
+                               status 不是 200 时收到 C0/C1 直接断开
+
+单独运行：python scripts/fake_origin.py 启动一组示例流并打印地址，Ctrl+C 退出
+"""
+
+import time
+import random
+import socket
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+STREAM_DEFAULTS = {
+    "latency": 0.0,          # 每个请求返回响应头之前的延迟（秒）
+    "bandwidth": None,       # 响应体限速（字节/秒），None 为不限
+    "status": 200,           # 入口（index.m3u8 / live）的状态码
+    "segment_status": 200,   # 分片的状态码：播放列表正常、分片 403 的情况很常见
+    "hang": False,           # True 时收到请求后一直不响应
+    "redirect": None,        # 入口 302 到另一个流的同一路径
+    "variants": None,        # 主播放列表的码率列表，如 [800_000, 3_000_000]
+    "bitrate": 2_000_000,    # 没有 variants 时媒体播放列表的码率（bps）
+    "segment_seconds": 4,
+    "segments": 3,
+    "content": None,         # 分片内容种子，默认为流名
+    "host": 0,               # 绑定在第几个回环地址上
+    "protocol": "http",      # http / rtsp / rtmp
+}
+
+CHUNK = 16 * 1024
+HANG_SECONDS = 3600
+
+EXAMPLE_STREAMS = {
+    "fast": {"latency": 0.02},
+    "slow": {"latency": 0.8, "host": 1},
+    "throttled": {"bandwidth": 64 * 1024, "host": 2},
+    "forbidden": {"status": 403},
+    "segment-forbidden": {"segment_status": 403, "host": 1},
+    "hang": {"hang": True, "host": 2},
+    "redirect": {"redirect": "fast", "host": 3},
+    "abr": {"variants": [800_000, 3_000_000, 12_000_000], "host": 3},
+    "mirror": {"content": "fast", "host": 1},
+    "rtsp": {"protocol": "rtsp", "latency": 0.05},
+    "rtsp-missing": {"protocol": "rtsp", "status": 404, "host": 1},
+    "rtmp": {"protocol": "rtmp", "latency": 0.05, "host": 2},
+    "rtmp-down": {"protocol": "rtmp", "status": 503, "host": 3},
+}
+
+RTMP_VERSION = 3
+RTMP_HANDSHAKE_SIZE = 1536
+
+
+def loopback(i):
+    return f"127.0.0.{i + 1}"
+
+
+class FakeOrigin:
+    """streams: {流名: 配置}，未给出的配置项取 STREAM_DEFAULTS；hits 记录每个流收到的请求数"""
+
+    def __init__(self, streams, hosts=None):
+        self.streams = {name: {**STREAM_DEFAULTS, **cfg} for name, cfg in streams.items()}
+        self.hosts = hosts or max(cfg["host"] for cfg in self.streams.values()) + 1
+        self.addresses = []
+        self.rtsp_addresses = []
+        self.rtmp_addresses = {}
+        self.hits = {}
+        self._segments = {}
+        self._runner = None
+        self._servers = []
+        self._loop = None
+
+    # ---------- 地址 ----------
+
+    def base(self, name):
+        host, port = self.addresses[self.streams[name]["host"] % self.hosts]
+        return f"http://{host}:{port}/{name}"
+
+    def url(self, name, path="index.m3u8"):
+        cfg = self.streams[name]
+        if cfg["protocol"] == "rtsp":
+            host, port = self.rtsp_addresses[cfg["host"] % self.hosts]
+            return f"rtsp://{host}:{port}/{name}"
+        if cfg["protocol"] == "rtmp":
+            host, port = self.rtmp_addresses[name]
+            return f"rtmp://{host}:{port}/live/{name}"
+        return f"{self.base(name)}/{path}"
+
+    def total_hits(self):
+        return sum(self.hits.values())
+
+    def reset_hits(self):
+        self.hits.clear()
+
+    # ---------- 内容 ----------
+
+    def _segment(self, seed, bitrate, n, seconds):
+        key = (seed, bitrate, n, seconds)
+        data = self._segments.get(key)
+        if data is None:
+            size = bitrate // 8 * seconds
+            data = self._segments[key] = random.Random(f"{seed}:{bitrate}:{n}").randbytes(size)
+        return data
+
+    @staticmethod
+    def _media_playlist(cfg, prefix=""):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{cfg['segment_seconds']}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for n in range(cfg["segments"]):
+            lines.append(f"#EXTINF:{cfg['segment_seconds']:.1f},")
+            lines.append(f"{prefix}seg{n}.ts")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _master_playlist(cfg):
+        lines = ["#EXTM3U"]
+        for bw in cfg["variants"]:
+            lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bw}")
+            lines.append(f"b{bw}/media.m3u8")
+        return "\n".join(lines) + "\n"
+
+    # ---------- 请求处理 ----------
+
+    async def _enter(self, request, entry):
+        """公共部分：计数、挂起、延迟、状态码和重定向；需要直接返回时返回响应对象"""
+        name = request.match_info["name"]
+        cfg = self.streams.get(name)
+        if cfg is None or cfg["protocol"] != "http":
+            return None, web.Response(status=404)
+        await self._wait(name, cfg)
+        if entry:
+            if cfg["status"] != 200:
+                return cfg, web.Response(status=cfg["status"])
+            if cfg["redirect"]:
+                target = self.base(cfg["redirect"]) + request.path[len(name) + 1:]
+                raise web.HTTPFound(target)
+        return cfg, None
+
+    async def _wait(self, name, cfg):
+        """每个请求都走的部分：计数、挂起、延迟"""
+        self.hits[name] = self.hits.get(name, 0) + 1
+        if cfg["hang"]:
+            await asyncio.sleep(HANG_SECONDS)
+        if cfg["latency"]:
+            await asyncio.sleep(cfg["latency"])
+
+    async def _send(self, request, cfg, body, content_type):
+        if not cfg["bandwidth"]:
+            return web.Response(body=body, content_type=content_type)
+        resp = web.StreamResponse(headers={"Content-Type": content_type, "Content-Length": str(len(body))})
+        await resp.prepare(request)
+        try:
+            for i in range(0, len(body), CHUNK):
+                chunk = body[i:i + CHUNK]
+                await resp.write(chunk)
+                await asyncio.sleep(len(chunk) / cfg["bandwidth"])
+            await resp.write_eof()
+        except ConnectionResetError:
+            # 测速方读够字节数就断开
+            pass
+        return resp
+
+    async def _index(self, request):
+        cfg, resp = await self._enter(request, entry=True)
+        if resp is not None:
+            return resp
+        if cfg["variants"]:
+            text = self._master_playlist(cfg)
+        else:
+            text = self._media_playlist(cfg, f"b{cfg['bitrate']}/")
+        return web.Response(text=text, content_type="application/vnd.apple.mpegurl")
+
+    async def _media(self, request):
+        cfg, resp = await self._enter(request, entry=False)
+        if resp is not None:
+            return resp
+        return web.Response(text=self._media_playlist(cfg), content_type="application/vnd.apple.mpegurl")
+
+    async def _seg(self, request):
+        cfg, resp = await self._enter(request, entry=False)
+        if resp is not None:
+            return resp
+        if cfg["segment_status"] != 200:
+            return web.Response(status=cfg["segment_status"])
+        name = request.match_info["name"]
+        bitrate = int(request.match_info["bitrate"])
+        n = int(request.match_info["n"])
+        data = self._segment(cfg["content"] or name, bitrate, n, cfg["segment_seconds"])
+        return await self._send(request, cfg, data, "video/mp2t")
+
+    async def _live(self, request):
+        cfg, resp = await self._enter(request, entry=True)
+        if resp is not None:
+            return resp
+        name = request.match_info["name"]
+        resp = web.StreamResponse(headers={"Content-Type": "video/x-flv"})
+        await resp.prepare(request)
+        rate = cfg["bandwidth"] or cfg["bitrate"] // 8
+        n = 0
+        try:
+            while True:
+                # 裸流循环使用 8 段一秒长的内容，缓存不会无限增长
+                data = self._segment(cfg["content"] or name, cfg["bitrate"], n % 8, 1)
+                for i in range(0, len(data), CHUNK):
+                    await resp.write(data[i:i + CHUNK])
+                    await asyncio.sleep(CHUNK / rate)
+                n += 1
+        except ConnectionResetError:
+            return resp
+
+    # ---------- RTSP / RTMP ----------
+
+    async def _rtsp_client(self, reader, writer):
+        """一个连接上依次应答请求：OPTIONS 总是 200，DESCRIBE 按流配置的 status"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line or line in (b"\r\n", b"\n"):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                if len(parts) < 3:
+                    break
+                method, url = parts[0], parts[1]
+                name = urlsplit(url).path.strip("/")
+                cfg = self.streams.get(name)
+                status, extra, body = 404, "", b""
+                if cfg is not None and cfg["protocol"] == "rtsp":
+                    await self._wait(name, cfg)
+                    if method == "OPTIONS":
+                        status, extra = 200, "Public: OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN\r\n"
+                    elif method == "DESCRIBE":
+                        status = cfg["status"]
+                        if status == 200:
+                            body = self._sdp(name).encode()
+                            extra = "Content-Type: application/sdp\r\n"
+                    else:
+                        status = 501
+                head = (
+                    f"RTSP/1.0 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"CSeq: {headers.get('cseq', '0')}\r\n{extra}Content-Length: {len(body)}\r\n\r\n"
+                )
+                writer.write(head.encode() + body)
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # 关闭时取消的连接（挂起中）正常结束，否则 asyncio 会对每个连接报一次异常
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _sdp(name):
+        return (
+            "v=0\r\n"
+            "o=- 0 0 IN IP4 127.0.0.1\r\n"
+            f"s={name}\r\n"
+            "t=0 0\r\n"
+            "m=video 0 RTP/AVP 96\r\n"
+            "a=rtpmap:96 H264/90000\r\n"
+        )
+
+    def _rtmp_handler(self, name):
+        cfg = self.streams[name]
+
+        async def handle(reader, writer):
+            """C0/C1 -> S0/S1/S2 -> C2；status 不是 200 时不握手直接断开"""
+            try:
+                c0c1 = await reader.readexactly(1 + RTMP_HANDSHAKE_SIZE)
+                await self._wait(name, cfg)
+                if cfg["status"] != 200:
+                    return
+                s1 = bytes(8) + random.Random(name).randbytes(RTMP_HANDSHAKE_SIZE - 8)
+                writer.write(bytes([RTMP_VERSION]) + s1 + c0c1[1:])
+                await writer.drain()
+                await reader.readexactly(RTMP_HANDSHAKE_SIZE)
+            except (ConnectionResetError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                pass
+            finally:
+                writer.close()
+        return handle
+
+    async def _serve(self, handler, host):
+        server = await asyncio.start_server(handler, host, 0)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    # ---------- 启动 / 停止 ----------
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/{name}/index.m3u8", self._index)
+        app.router.add_get("/{name}/b{bitrate:\\d+}/media.m3u8", self._media)
+        app.router.add_get("/{name}/b{bitrate:\\d+}/seg{n:\\d+}.ts", self._seg)
+        app.router.add_get("/{name}/live", self._live)
+        self._runner = web.AppRunner(app, shutdown_timeout=0.5)
+        await self._runner.setup()
+        self.addresses = []
+        for i in range(self.hosts):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((loopback(i), 0))
+            self.addresses.append(sock.getsockname())
+            await web.SockSite(self._runner, sock).start()
+        protocols = {cfg["protocol"] for cfg in self.streams.values()}
+        if "rtsp" in protocols:
+            self.rtsp_addresses = [await self._serve(self._rtsp_client, loopback(i)) for i in range(self.hosts)]
+        for name, cfg in self.streams.items():
+            if cfg["protocol"] == "rtmp":
+                host = loopback(cfg["host"] % self.hosts)
+                self.rtmp_addresses[name] = await self._serve(self._rtmp_handler(name), host)
+        return self
+
+    async def stop(self):
+        # 只关监听；挂起中的连接不等（wait_closed 会一直等它们结束）
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _shutdown(self):
+        """后台模式的收尾：事件循环是自己的，挂起中的请求处理不会自己结束，全部取消"""
+        await self.stop()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start_in_background(self):
+        """在后台线程的事件循环里运行，给同步代码和其他事件循环用"""
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="fake-origin", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+        self._loop = loop
+        return self
+
+    def close(self):
+        loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def main():
+    origin = FakeOrigin(EXAMPLE_STREAMS).start_in_background()
+    for name in EXAMPLE_STREAMS:
+        print(f"{name:18} {origin.url(name)}")
+    print("Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        origin.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游主机健康记录 + 熔断
+
+按主机（host:port）持久化记录成功、失败次数和延迟。连续失败达到阈值的主机进入熔断状态，
+冷却期内直接跳过，不再每次运行都花几分钟重试已经挂掉的镜像；冷却期结束后放行一次试探请求，
+成功则恢复，失败则冷却期翻倍。重试之间使用指数退避 + 随机抖动，代替固定的 sleep。
+"""
+
+import os
+import json
+import time
+import random
+import atexit
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 可用环境变量 HEALTH_FILE 换位置（cassette.py 回放时用临时文件）
+HEALTH_FILE = os.environ.get("HEALTH_FILE") or os.path.join(SCRIPT_DIR, "host_health.json")
+
+# 连续失败多少次后熔断
+FAILURE_THRESHOLD = 3
+# 熔断冷却时间：首次 30 分钟，之后每次翻倍，最长 12 小时
+COOLDOWN_BASE = 30 * 60
+COOLDOWN_MAX = 12 * 3600
+# 重试退避：1s、2s、4s... 最长 10s，再乘以 0.5~1 的随机抖动
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 10.0
+# 超过 30 天没有访问的主机记录会被清理
+STALE_AFTER = 30 * 24 * 3600
+# 延迟滑动平均系数
+LATENCY_ALPHA = 0.3
+
+
+def host_of(url):
+    try:
+        p = urlparse(url)
+    except ValueError:
+        return ""
+    host = (p.hostname or "").lower()
+    if not host:
+        return ""
+    port = p.port
+    if port and port != {"http": 80, "https": 443}.get(p.scheme):
+        return f"{host}:{port}"
+    return host
+
+
+class HostHealth:
+    def __init__(self, path=HEALTH_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._hosts = self._load()
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+
+    def _entry(self, host):
+        e = self._hosts.get(host)
+        if e is None:
+            e = {"ok": 0, "fail": 0, "streak": 0, "trips": 0,
+                 "open_until": 0, "latency": None, "seen": 0}
+            self._hosts[host] = e
+        return e
+
+    def allow(self, url):
+        """熔断中的主机返回 False；冷却结束的主机放行（半开状态）"""
+        host = host_of(url)
+        if not host:
+            return True
+        with self._lock:
+            e = self._hosts.get(host)
+            return not e or e.get("open_until", 0) <= time.time()
+
+    def record_success(self, url, latency=None):
+        host = host_of(url)
+        if not host:
+            return
+        with self._lock:
+            e = self._entry(host)
+            e["ok"] += 1
+            e["streak"] = 0
+            e["trips"] = 0
+            e["open_until"] = 0
+            e["seen"] = time.time()
+            if latency is not None:
+                prev = e.get("latency")
+                e["latency"] = latency if prev is None else prev + LATENCY_ALPHA * (latency - prev)
+            self._dirty = True
+
+    def record_failure(self, url):
+        host = host_of(url)
+        if not host:
+            return
+        with self._lock:
+            e = self._entry(host)
+            now = time.time()
+            e["fail"] += 1
+            e["streak"] += 1
+            e["seen"] = now
+            # 半开状态下试探失败，或连续失败达到阈值 -> 熔断
+            half_open = e["trips"] > 0 and e["open_until"] <= now
+            if half_open or e["streak"] >= FAILURE_THRESHOLD:
+                cooldown = min(COOLDOWN_MAX, COOLDOWN_BASE * (2 ** e["trips"]))
+                e["trips"] += 1
+                e["open_until"] = now + cooldown
+                print(f"⛔ 主机熔断 {host}，{cooldown // 60:.0f} 分钟内跳过")
+            self._dirty = True
+
+    def backoff(self, attempt):
+        """第 attempt 次（从 0 开始）重试前的等待时间"""
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            hosts = {h: e for h, e in self._hosts.items()
+                     if now - e.get("seen", 0) < STALE_AFTER}
+            self._dirty = False
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(hosts, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"保存主机健康记录失败: {e}")
+
+
+REGISTRY = HostHealth()
+atexit.register(REGISTRY.save)
+
+
+def _host_alive(error):
+    """HTTP 4xx 说明主机在线，只是资源有问题，不计入主机失败（requests 的 HTTPError / aiohttp 的 ClientResponseError）"""
+    resp = getattr(error, "response", None)
+    status = getattr(resp, "status_code", None)
+    if status is None:
+        status = getattr(error, "status", None)
+    return isinstance(status, int) and status < 500
+
+
+def fetch_with_health(url, attempt, retry=3):
+    """
+    attempt() 返回结果；返回 None 表示本次没拿到内容（主机在线），抛异常表示请求失败，
+    HTTP 错误状态要抛出（raise_for_status），5xx 才会计入主机失败。熔断中的主机直接返回 None。
+    """
+    if not REGISTRY.allow(url):
+        print(f"⏭ 跳过熔断主机: {url}")
+        return None
+
+    for i in range(retry):
+        start = time.time()
+        try:
+            result = attempt()
+            REGISTRY.record_success(url, time.time() - start)
+            if result is not None:
+                return result
+        except Exception as e:
+            if _host_alive(e):
+                REGISTRY.record_success(url, time.time() - start)
+            else:
+                REGISTRY.record_failure(url)
+                if not REGISTRY.allow(url):
+                    return None
+            print(f"  第{i + 1}次尝试失败: {url} ({e})")
+        if i < retry - 1:
+            time.sleep(REGISTRY.backoff(i))
+    return None
+
+
+async def fetch_with_health_async(url, attempt, retry=1):
+    """asyncio 版本，attempt 为协程函数"""
+    if not REGISTRY.allow(url):
+        print(f"⏭ 跳过熔断主机: {url}")
+        return None
+
+    for i in range(retry):
+        start = time.time()
+        try:
+            result = await attempt()
+            REGISTRY.record_success(url, time.time() - start)
+            if result is not None:
+                return result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if _host_alive(e):
+                REGISTRY.record_success(url, time.time() - start)
+            else:
+                REGISTRY.record_failure(url)
+                if not REGISTRY.allow(url):
+                    return None
+            print(f"  第{i + 1}次尝试失败: {url} ({e})")
+        if i < retry - 1:
+            await asyncio.sleep(REGISTRY.backoff(i))
+    return None
@@ -3,10 +3,12 @@
 
 import os
 import re
-import time
-import requests
+import sys
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from source_loader import load_sources
+from playlist_stream import load_channels
+from prober import sticky_failover_many
 
 # ===================== 路径 =====================
 
@@ -76,19 +78,6 @@ TW_TARGET_ORDER = [
     "龍華電影","龍華日韓","龍華偶像","龍華戲劇","龍華經典","DayStar"
 ]
 
-# ===================== 下载 =====================
-
-def download(url, retry=2):
-    headers={"User-Agent":"Mozilla/5.0"}
-    for i in range(retry):
-        try:
-            r=requests.get(url,headers=headers,timeout=15)
-            if r.status_code==200:
-                return r.text
-        except:
-            time.sleep(1)
-    return ""
-
 # ===================== 工具 =====================
 
 def clean_name(name):
@@ -96,13 +85,6 @@ def clean_name(name):
     name = re.sub(r'「.*?」', '', name)
     return name.strip()
 
-def parse_name(extinf):
-    return clean_name(extinf.split(",",1)[-1])
-
-def parse_group(extinf):
-    m=re.search(r'group-title="([^"]*)"',extinf)
-    return m.group(1) if m else ""
-
 def normalize_group(extinf, group):
     """确保返回字符串，不返回None"""
     if extinf is None:
@@ -126,104 +108,52 @@ def dedup(data):
 
 # ===================== 解析 =====================
 
-def parse_m3u(content):
-    lines=content.splitlines()
+def to_items(channels):
+    """Channel 记录 -> (name, extinf, url)，TXT 源补一个默认 #EXTINF"""
     out=[]
-    ext=None
-    for l in lines:
-        l=l.strip()
-        if l.startswith("#EXTINF"):
-            ext=l
-        elif l.startswith("http") and ext:
-            name=parse_name(ext)
-            out.append((name,ext,l))
-    return out
-
-def parse_txt(content):
-    out=[]
-    for l in content.splitlines():
-        if "," in l and "http" in l:
-            name,url=l.split(",",1)
-            name=clean_name(name)
-            ext=f'#EXTINF:-1 group-title="未知",{name}'
-            out.append((name,ext,url))
+    for c in channels:
+        name=clean_name(c.name)
+        ext=c.extinf or f'#EXTINF:-1 group-title="未知",{name}'
+        out.append((name,ext,c.url))
     return out
 
 # ===================== ⭐ CHC（只从上海提取） =====================
 
 def load_chc_from_shanghai():
     url = "https://github.chenc.dev/raw.githubusercontent.com/CKL1211/eric/refs/heads/master/MyIPTV.m3u"
-    raw = download(url)
-    if not raw:
-        return []
-    
-    data = parse_m3u(raw)
+    data = load_channels(url)
     result = []
 
-    for n, e, u in data:
-        if parse_group(e) != "上海":
+    for c in data:
+        if c.group != "上海":
             continue
 
-        m = re.search(r'tvg-name="([^"]+)"', e)
-        if not m:
-            continue
-
-        tvg_name = m.group(1).strip()
+        tvg_name = c.attrs.get("tvg-name", "").strip()
 
         if tvg_name in CHC_TARGET:
-            result.append((tvg_name, e, u))
+            result.append((tvg_name, c.extinf, c.url))
 
     return result
 
 # ===================== EXTRA =====================
 
+def parse_source(url, channels):
+    return to_items(channels)
+
 def load_extra():
     data=[]
-    for url in EXTRA_URLS:
-        raw=download(url)
-        if not raw:
-            continue
-        if "#EXTINF" in raw:
-            data+=parse_m3u(raw)
-        else:
-            data+=parse_txt(raw)
+    for url,items in load_sources(EXTRA_URLS, load_channels, parse_source):
+        if items:
+            data+=items
     return data
 
-# ===================== 测速 =====================
-
-def check(url):
-    try:
-        t0=time.time()
-        r=requests.get(url,timeout=5,stream=True)
-        if r.status_code==200:
-            return url,time.time()-t0
-    except:
-        pass
-    return url,999
-
-def pick_best(urls):
-    if not urls:
-        return None
-    
-    best=None
-    best_t=999
-    with ThreadPoolExecutor(max_workers=5) as ex:
-        futures = [ex.submit(check, u) for u in urls if u]
-        for f in as_completed(futures):
-            u,t = f.result()
-            if t < best_t:
-                best, best_t = u, t
-    return best
-
 # ===================== TW =====================
 
-def fetch_tw(lines):
-    parsed=parse_m3u("\n".join(lines))
-
+def fetch_tw(channels):
     temp=[]
-    for n,e,u in parsed:
-        if parse_group(e)==TW_SOURCE_GROUP:
-            temp.append((clean_name(n),e,u))
+    for c in channels:
+        if c.group==TW_SOURCE_GROUP:
+            temp.append((clean_name(c.name),c.extinf,c.url))
 
     temp=dedup(temp)
 
@@ -243,19 +173,16 @@ def fetch_tw(lines):
 
 def main():
 
-    content=download(SOURCE_URL)
-    if not content:
+    # 主源边下边解析，HK/TW 直接从解析出的记录里按分组取
+    main_data=load_channels(SOURCE_URL)
+    if not main_data:
         print("❌ 无法下载主源")
-        return
-    
-    lines=content.splitlines()
+        sys.exit(1)
 
-    main_data=parse_m3u(content)
-
-    hk=[x for x in main_data if HK_SOURCE_GROUP in x[1]]
+    hk=[(clean_name(c.name),c.extinf,c.url) for c in main_data if HK_SOURCE_GROUP in c.group]
     hk=dedup(hk)
 
-    tw=fetch_tw(lines)
+    tw=fetch_tw(main_data)
 
     custom_extinf = '#EXTINF:-1 tvg-id="中天新聞台" tvg-name="中天新聞台" tvg-logo="https://epg.iill.top/logo/中天新聞台.png" http-user-agent="okhttp/1.9.89",中天新聞台'
     custom_url = "https://v.iill.top/4gtv/4gtv-4gtv009/index.m3u8"
@@ -279,13 +206,6 @@ def main():
         if n in CCTV_TARGET:
             cctv_map.setdefault(n,[]).append((e,u))
 
-    cctv=[]
-    for name in CCTV_TARGET:
-        if name in cctv_map:
-            best=pick_best([u for _,u in cctv_map[name]])
-            if best:  # 确保有有效的URL
-                cctv.append((name, cctv_map[name][0][0], best))
-
     # ⭐ CHC（只用上海源）
     chc_raw = load_chc_from_shanghai()
 
@@ -293,15 +213,29 @@ def main():
     for n,e,u in chc_raw:
         chc_map.setdefault(n,[]).append((e,u))
 
+    # 测速：CCTV + CHC 所有候选一次提交，上次选中的地址健康就直接沿用；
+    # 设置了 FAILOVER_URLS 时每个频道连续输出前 N 个可用地址
+    best_map=sticky_failover_many("joker", {
+        **{("cctv",n):[u for _,u in cctv_map[n]] for n in CCTV_TARGET if n in cctv_map},
+        **{("chc",n):[u for _,u in chc_map[n]] for n in CHC_TARGET if n in chc_map},
+    })
+
+    cctv=[]
+    for name in CCTV_TARGET:
+        if name in cctv_map:
+            urls=best_map[("cctv",name)]
+            if urls:  # 确保有有效的URL
+                cctv.append((name, cctv_map[name][0][0], urls))
+
     chc=[]
     for name in CHC_TARGET:
         if name in chc_map:
-            best=pick_best([u for _,u in chc_map[name]])
-            if best:  # 确保有有效的URL
+            urls=best_map[("chc",name)]
+            if urls:  # 确保有有效的URL
                 ext = chc_map[name][0][0]
                 if name in LOGO_MAP:
                     ext = re.sub(r'tvg-logo="[^"]*"', f'tvg-logo="{LOGO_MAP[name]}"', ext)
-                chc.append((name, ext, best))
+                chc.append((name, ext, urls))
 
     # ===================== 输出 =====================
 
@@ -318,18 +252,20 @@ def main():
     # 数字频道
     if cctv:
         out+="\n# 数字\n"
-        for n,e,u in cctv:
+        for n,e,urls in cctv:
             normalized = normalize_group(e, "数字")
             if normalized:  # 确保不是None
-                out += normalized + "\n" + u + "\n"
+                for u in urls:
+                    out += normalized + "\n" + u + "\n"
 
     # CHC频道
     if chc:
         out+="\n# CHC\n"
-        for n,e,u in chc:
+        for n,e,urls in chc:
             normalized = normalize_group(e, "CHC")
             if normalized:
-                out += normalized + "\n" + u + "\n"
+                for u in urls:
+                    out += normalized + "\n" + u + "\n"
 
     # HK频道
     if hk:
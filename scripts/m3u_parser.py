@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共用的 M3U / TXT 解析
+
+每条 #EXTINF 只用一个预编译的属性正则扫描一遍，得到全部属性（group-title、tvg-name、
+tvg-logo ...）和频道名，结果放进带 __slots__ 的 Channel 记录，
+各脚本不再各自对同一行反复 re.search。
+
+PlaylistReader 按行喂入，可以直接接在 HTTP 响应的 iter_lines 后面边下边解析，
+并在流里按分组过滤，整份播放列表不需要完整留在内存里。
+"""
+
+import re
+
+# key="value" 形式的属性
+ATTR_RE = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+
+DEFAULT_SCHEMES = ("http://", "https://")
+STREAM_SCHEMES = ("http://", "https://", "rtmp://", "rtsp://")
+
+# 自动识别格式时最多往前看的行数
+DETECT_LINES = 20
+
+
+class Channel:
+    """一个频道条目：name 频道名，attrs 属性字典，group 分组，url 播放地址，extinf 原始 #EXTINF 行"""
+
+    __slots__ = ("name", "attrs", "group", "url", "extinf")
+
+    def __init__(self, name, attrs, group, url, extinf):
+        self.name = name
+        self.attrs = attrs
+        self.group = group
+        self.url = url
+        self.extinf = extinf
+
+    def __repr__(self):
+        return f"Channel({self.name!r}, group={self.group!r}, url={self.url!r})"
+
+
+def parse_extinf(line):
+    """扫描一次 #EXTINF 行，返回 (属性字典, 频道名)；频道名取最后一个属性之后第一个逗号后的内容"""
+    attrs = {}
+    end = 0
+    for m in ATTR_RE.finditer(line):
+        attrs[m.group(1)] = m.group(2)
+        end = m.end()
+    comma = line.find(",", end)
+    name = line[comma + 1:].strip() if comma != -1 else ""
+    return attrs, name
+
+
+class PlaylistReader:
+    """
+    逐行喂入的播放列表解析器
+
+    fmt 为 "m3u" / "txt" 时按指定格式解析，为 None 时根据开头几行自动识别；
+    groups 不为空时只产出这些分组的频道，其余条目在流里直接丢弃。
+    feed() / close() 返回本次新解析出的 Channel 列表。
+    """
+
+    def __init__(self, schemes=DEFAULT_SCHEMES, groups=None, fmt=None):
+        self.schemes = schemes
+        self.groups = set(groups) if groups else None
+        self.fmt = fmt
+        self._head = []
+        self._pending = None
+        self._group = ""
+
+    def feed(self, line):
+        if self.fmt is None:
+            self._head.append(line)
+            if line.lstrip().startswith("#EXT"):
+                self.fmt = "m3u"
+            elif len(self._head) >= DETECT_LINES:
+                self.fmt = "txt"
+            else:
+                return []
+            return self._flush_head()
+        c = self._feed_m3u(line) if self.fmt == "m3u" else self._feed_txt(line)
+        return [c] if c is not None else []
+
+    def close(self):
+        if self.fmt is None:
+            self.fmt = "txt"
+            return self._flush_head()
+        return []
+
+    def _flush_head(self):
+        head, self._head = self._head, []
+        out = []
+        for line in head:
+            out.extend(self.feed(line))
+        return out
+
+    def _wanted(self, group):
+        return self.groups is None or group in self.groups
+
+    def _feed_m3u(self, line):
+        line = line.strip()
+        if not line:
+            return None
+        if line.startswith("#EXTINF"):
+            attrs, name = parse_extinf(line)
+            self._pending = (attrs, name, line) if self._wanted(attrs.get("group-title", "")) else None
+            return None
+        if line.startswith("#"):
+            return None
+        pending, self._pending = self._pending, None
+        if pending is not None and line.startswith(self.schemes):
+            attrs, name, extinf = pending
+            return Channel(name, attrs, attrs.get("group-title", ""), line, extinf)
+        return None
+
+    def _feed_txt(self, line):
+        line = line.strip()
+        if not line or "," not in line:
+            return None
+        name, url = line.split(",", 1)
+        name, url = name.strip(), url.strip()
+        if url == "#genre#":
+            self._group = name
+            return None
+        if url.startswith(self.schemes) and self._wanted(self._group):
+            return Channel(name, {}, self._group, url, "")
+        return None
+
+
+def iter_playlist(lines, schemes=DEFAULT_SCHEMES, groups=None, fmt=None):
+    """逐行解析，边读边产出 Channel"""
+    reader = PlaylistReader(schemes, groups, fmt)
+    for line in lines:
+        for c in reader.feed(line):
+            yield c
+    for c in reader.close():
+        yield c
+
+
+def iter_m3u(lines, schemes=DEFAULT_SCHEMES, groups=None):
+    """逐行解析 M3U，每遇到一个播放地址产出一个 Channel；没有 #EXTINF 的地址忽略"""
+    return iter_playlist(lines, schemes, groups, "m3u")
+
+
+def iter_txt(lines, schemes=DEFAULT_SCHEMES, groups=None):
+    """解析 “频道名,地址” 格式；“分组,#genre#” 行设置后续频道的分组"""
+    return iter_playlist(lines, schemes, groups, "txt")
+
+
+def parse_m3u(content, schemes=DEFAULT_SCHEMES):
+    return list(iter_m3u((content or "").splitlines(), schemes))
+
+
+def parse_txt(content, schemes=DEFAULT_SCHEMES):
+    return list(iter_txt((content or "").splitlines(), schemes))
+
+
+def parse_playlist(content):
+    """根据内容自动选择 M3U 或 TXT 解析"""
+    if content and "#EXTINF" in content:
+        return parse_m3u(content)
+    return parse_txt(content)
+
+
+def parse_playlist_streams(content):
+    """同 parse_playlist，额外接受 rtmp/rtsp 地址"""
+    if content and "#EXTINF" in content:
+        return parse_m3u(content, STREAM_SCHEMES)
+    return parse_txt(content, STREAM_SCHEMES)
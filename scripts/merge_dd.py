@@ -7,7 +7,13 @@ import requests
 import re
 from datetime import datetime
 import sys
-import time
+
+from single_flight import shared_download
+from artefacts import resolve_artefact
+from host_health import fetch_with_health
+from m3u_parser import parse_m3u
+from playlist_stream import fetch_channels
+from decoding import response_text
 
 # ================== 配置 ==================
 
@@ -87,17 +93,17 @@ def get_tw_channel_priority(name):
 def log(msg):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
 
+@shared_download
 def download(url, desc, retries=3):
-    for attempt in range(retries):
-        try:
-            log(f"下载 {desc}... (尝试 {attempt+1}/{retries})")
-            r = requests.get(url, timeout=30, headers={"User-Agent":"Mozilla/5.0"})
-            r.raise_for_status()
-            return r.text
-        except Exception as e:
-            log(f"失败: {e}")
-            time.sleep(3)
-    return None
+    def attempt():
+        log(f"下载 {desc}...")
+        r = requests.get(url, timeout=30, headers={"User-Agent":"Mozilla/5.0"})
+        r.raise_for_status()
+        return response_text(r)
+    text = fetch_with_health(url, attempt, retries)
+    if text is None:
+        log(f"失败: {desc}")
+    return text
 
 def is_sports_channel(name):
     return "博斯" in name if name else False
@@ -127,13 +133,17 @@ def should_filter_channel(name, url):
 def main():
     log("开始生成 DD.m3u ...")
 
-    bb = download(BB_URL, "BB.m3u")
+    # BB.m3u / EE.m3u 优先读本仓库里的文件
+    bb = resolve_artefact(BB_URL, download, "BB.m3u")
     if not bb:
         sys.exit(1)
 
-    ee = download(EE_URL, "EE.m3u") or ""
-    gat_content = download(GAT_URL, "港台大陆源文件") or ""
-    tw_source_content = download(TW_SOURCE_URL, "台湾源文件") or ""
+    ee = resolve_artefact(EE_URL, download, "EE.m3u") or ""
+    # 港台/台湾源只需要少数分组，边下载边过滤
+    log("下载 港台大陆源文件...")
+    gat_channels = fetch_channels(GAT_URL, groups=SOURCE_GROUPS, retry=3, timeout=30)
+    log("下载 台湾源文件...")
+    tw_source_channels = fetch_channels(TW_SOURCE_URL, groups=[TARGET_TW_GROUP, "•體育「Relay」"], retry=3, timeout=30)
 
     hk_channels = []
     tw_channels = []
@@ -142,102 +152,67 @@ def main():
     # ===== 从EE.m3u提取HK频道 =====
     if ee:
         log("开始解析 EE.m3u 中的 HK 频道...")
-        lines = ee.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
+        for c in parse_m3u(ee):
             # 匹配EE.m3u的格式：group-title="HK"
-            if line.startswith("#EXTINF:") and 'group-title="HK"' in line:
-                # 提取原始频道名（用于过滤）
-                raw_name = line.split(",")[-1].strip()
-                # 确保有下一行（URL行）
-                if i+1 < len(lines):
-                    url = lines[i+1].strip()
-                    # 跳过空URL或注释行
-                    if url and not url.startswith('#'):
-                        # 先基于原始名称进行过滤
-                        if not should_filter_channel(raw_name, url):
-                            # 过滤通过，再清洗名称用于存储
-                            cleaned_name = clean_channel_name(raw_name)
-                            hk_channels.append((cleaned_name, url))
-                            log(f"从EE.m3u添加HK频道: {raw_name} -> {cleaned_name}")
-                        else:
-                            log(f"从EE.m3u过滤频道: {raw_name}")
-                    i += 1
-            i += 1
+            if c.group != "HK":
+                continue
+            raw_name = c.name
+            # 先基于原始名称进行过滤
+            if not should_filter_channel(raw_name, c.url):
+                # 过滤通过，再清洗名称用于存储
+                cleaned_name = clean_channel_name(raw_name)
+                hk_channels.append((cleaned_name, c.url))
+                log(f"从EE.m3u添加HK频道: {raw_name} -> {cleaned_name}")
+            else:
+                log(f"从EE.m3u过滤频道: {raw_name}")
         log(f"EE.m3u 解析完成，共添加 {len(hk_channels)} 个HK频道")
 
     # ===== 解析GAT源获取HK频道（原逻辑）=====
-    if gat_content:
-        lines = gat_content.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith("#EXTINF:"):
-                # 检查是否属于目标分组
-                if any(f'group-title="{group}"' in line for group in SOURCE_GROUPS):
-                    if i+1 < len(lines):
-                        url = lines[i+1].strip()
-                        
-                        raw_name = line.split(",")[-1].strip()
-                        
-                        # 先基于原始名称进行过滤
-                        if not should_filter_channel(raw_name, url):
-                            # 过滤通过，再清洗名称
-                            cleaned_name = clean_channel_name(raw_name)
-                            
-                            # 检查是否已存在相同URL的频道（去重）
-                            url_exists = False
-                            for existing_name, existing_url in hk_channels:
-                                if existing_url == url:
-                                    url_exists = True
-                                    break
-                            if not url_exists:
-                                hk_channels.append((cleaned_name, url))
-                                log(f"从GAT源添加HK频道: {raw_name} -> {cleaned_name}")
-                        else:
-                            log(f"从GAT源过滤频道: {raw_name}")
-                    i += 1
-            i += 1
+    if gat_channels:
+        hk_urls = {url for _, url in hk_channels}
+        for c in gat_channels:
+            raw_name = c.name
+
+            # 先基于原始名称进行过滤
+            if not should_filter_channel(raw_name, c.url):
+                # 过滤通过，再清洗名称
+                cleaned_name = clean_channel_name(raw_name)
+
+                # 检查是否已存在相同URL的频道（去重）
+                if c.url not in hk_urls:
+                    hk_urls.add(c.url)
+                    hk_channels.append((cleaned_name, c.url))
+                    log(f"从GAT源添加HK频道: {raw_name} -> {cleaned_name}")
+            else:
+                log(f"从GAT源过滤频道: {raw_name}")
 
     # ===== TW 处理 =====
-    if tw_source_content:
-        lines = tw_source_content.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith("#EXTINF:") and f'group-title="{TARGET_TW_GROUP}"' in line:
-                raw_name = line.split(",")[-1].strip()
-                if i+1 < len(lines):
-                    url = lines[i+1].strip()
-                    # 先基于原始名称进行过滤
-                    if not should_filter_channel(raw_name, url):
-                        # 过滤通过，再清洗名称
-                        cleaned_name = clean_channel_name(raw_name)
-                        if "博斯" in raw_name:  # 基于原始名称判断体育频道
-                            sports_channels.append((line, cleaned_name, url))
-                            log(f"添加博斯体育频道: {raw_name} -> {cleaned_name}")
-                        else:
-                            tw_channels.append((line, cleaned_name, url))
-                            log(f"添加TW频道: {raw_name} -> {cleaned_name}")
+    if tw_source_channels:
+        for c in tw_source_channels:
+            raw_name = c.name
+            if c.group == TARGET_TW_GROUP:
+                # 先基于原始名称进行过滤
+                if not should_filter_channel(raw_name, c.url):
+                    # 过滤通过，再清洗名称
+                    cleaned_name = clean_channel_name(raw_name)
+                    if "博斯" in raw_name:  # 基于原始名称判断体育频道
+                        sports_channels.append((c.extinf, cleaned_name, c.url))
+                        log(f"添加博斯体育频道: {raw_name} -> {cleaned_name}")
                     else:
-                        log(f"过滤TW频道: {raw_name}")
-                    i += 1
+                        tw_channels.append((c.extinf, cleaned_name, c.url))
+                        log(f"添加TW频道: {raw_name} -> {cleaned_name}")
+                else:
+                    log(f"过滤TW频道: {raw_name}")
             # 提取 •體育「Relay」 分组
-            elif line.startswith("#EXTINF:") and 'group-title="•體育「Relay」"' in line:
-                raw_name = line.split(",")[-1].strip()
-                if i+1 < len(lines):
-                    url = lines[i+1].strip()
-                    # 先基于原始名称进行过滤
-                    if not should_filter_channel(raw_name, url):
-                        # 过滤通过，再清洗名称
-                        cleaned_name = clean_channel_name(raw_name)
-                        sports_channels.append((line, cleaned_name, url))
-                        log(f"添加体育Relay频道: {raw_name} -> {cleaned_name}")
-                    else:
-                        log(f"过滤体育Relay频道: {raw_name}")
-                    i += 1
-            i += 1
+            elif c.group == "•體育「Relay」":
+                # 先基于原始名称进行过滤
+                if not should_filter_channel(raw_name, c.url):
+                    # 过滤通过，再清洗名称
+                    cleaned_name = clean_channel_name(raw_name)
+                    sports_channels.append((c.extinf, cleaned_name, c.url))
+                    log(f"添加体育Relay频道: {raw_name} -> {cleaned_name}")
+                else:
+                    log(f"过滤体育Relay频道: {raw_name}")
 
     # ===== 对TW频道进行排序 =====
     if tw_channels:
@@ -3,9 +3,10 @@
 
 import os
 import re
-import time
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sys
+
+from playlist_stream import load_channels, fetch_channels
+from prober import sticky_failover_many
 
 # ===================== 路径 =====================
 
@@ -156,20 +157,6 @@ TW_TARGET_ORDER = [
     "DayStar"
 ]
 
-# ===================== 下载 =====================
-
-def download(url, retry=3):
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-    for i in range(retry):
-        try:
-            r = requests.get(url, headers=headers, timeout=15)
-            if r.status_code == 200:
-                return r.text
-        except Exception as e:
-            if i < retry - 1:
-                time.sleep(2)
-    return ""
-
 # ===================== 工具 =====================
 
 def clean_name(name):
@@ -177,13 +164,6 @@ def clean_name(name):
     name = re.sub(r'「.*?」', '', name)
     return name.strip()
 
-def parse_name(extinf):
-    return clean_name(extinf.split(",", 1)[-1])
-
-def parse_group(extinf):
-    m = re.search(r'group-title="([^"]*)"', extinf)
-    return m.group(1) if m else ""
-
 def normalize_group(extinf, group):
     if not extinf:
         return f'#EXTINF:-1 group-title="{group}",未知'
@@ -202,38 +182,28 @@ def dedup(data):
             out.append((n, e, u))
     return out
 
-# ===================== 解析 =====================
-
-def parse_m3u(content):
-    lines = content.splitlines()
-    out = []
-    ext = None
-    for l in lines:
-        l = l.strip()
-        if l.startswith("#EXTINF"):
-            ext = l
-        elif l.startswith("http") and ext:
-            name = parse_name(ext)
-            out.append((name, ext, l))
-            ext = None
-    return out
-
 # ===================== HK =====================
 
 def load_gat():
-    raw = download(GAT_SOURCE)
-    if not raw:
+    # 只需要港澳台分组，在下载流里直接过滤
+    data = fetch_channels(GAT_SOURCE, groups=[GAT_GROUP_NAME], retry=3)
+    if not data:
         print("⚠️ 无法下载GAT源")
         return []
-    data = parse_m3u(raw)
-    temp = [(clean_name(n), e, u) for n, e, u in data if parse_group(e) == GAT_GROUP_NAME]
+    temp = [(clean_name(c.name), c.extinf, c.url) for c in data]
     temp = dedup(temp)
 
-    result = []
+    groups = {}
     for target in GAT_TARGET_ORDER:
         candidates = [x for x in temp if target in x[0]]
         if candidates:
-            best = pick_best([u for _, _, u in candidates])
+            groups[target] = candidates
+    # 设置了 FAILOVER_URLS 时每个频道按排名连续输出前 N 个可用地址
+    best_map = sticky_failover_many("EE-GAT", {t: [u for _, _, u in c] for t, c in groups.items()})
+
+    result = []
+    for target, candidates in groups.items():
+        for best in best_map[target]:
             for n, e, u in candidates:
                 if u == best:
                     ext = e
@@ -250,8 +220,8 @@ def load_mv():
     
     # 主要源：用于提取原有MV频道以及新增的北京/港澳台频道
     main_source_url = "https://github.chenc.dev/raw.githubusercontent.com/CKL1211/eric/refs/heads/master/MyIPTV.m3u"
-    raw_main = download(main_source_url)
-    if not raw_main:
+    all_data = load_channels(main_source_url, retry=3)
+    if not all_data:
         print("⚠️ 无法下载主要MV源，尝试其他备选源...")
         all_data = []
         
@@ -261,13 +231,12 @@ def load_mv():
             "https://live.kilvn.com/iptv.m3u",
         ]
         for src in backup_sources:
-            raw = download(src)
-            if raw:
-                all_data.extend(parse_m3u(raw))
+            data = load_channels(src, retry=3)
+            if data:
+                all_data.extend(data)
                 print(f"✓ 从备选源获取到数据: {src}")
                 break
     else:
-        all_data = parse_m3u(raw_main)
         print(f"✓ 从主源获取到 {len(all_data)} 个频道")
     
     if not all_data:
@@ -276,9 +245,8 @@ def load_mv():
     
     # 统计各分组频道数量
     group_stats = {}
-    for n, e, u in all_data:
-        group = parse_group(e)
-        group_stats[group] = group_stats.get(group, 0) + 1
+    for c in all_data:
+        group_stats[c.group] = group_stats.get(c.group, 0) + 1
     
     # 针对新增频道的精确提取：从“北京”分组提取北京IPTV淘电影、北京IPTV4K；从“港澳台”分组提取天映频道、天映新加坡、爱奇艺、TVB星河
     # 同时保留原有MV频道的提取逻辑（放宽分组限制）
@@ -286,8 +254,8 @@ def load_mv():
     
     print("正在筛选符合条件的频道...")
     
-    for n, e, u in all_data:
-        group = parse_group(e)
+    for c in all_data:
+        n, e, u, group = clean_name(c.name), c.extinf, c.url, c.group
         # 原有MV频道提取条件：分组包含综合/电影/影视/MV/娱乐，或频道名包含CHC/龙华/ROCK/HBO/Cinemax
         original_condition = (any(keyword in group for keyword in ["综合", "电影", "影视", "MV", "娱乐", "影視"]) or
                               any(keyword in n for keyword in ["CHC", "龙华", "ROCK", "HBO", "Cinemax", "动作电影", "家庭影院", "影迷电影"]))
@@ -307,7 +275,7 @@ def load_mv():
     temp = dedup(temp)
     print(f"筛选后剩余 {len(temp)} 个候选频道")
     
-    result = []
+    groups = {}
     for target_name, keywords in MV_TARGET_ORDER:
         candidates = []
         for n, e, u in temp:
@@ -328,37 +296,42 @@ def load_mv():
             
             if len(unique_candidates) > 1:
                 print(f"  {target_name}: 找到 {len(unique_candidates)} 个候选URL，正在测速选择最优...")
-            
-            # 测速选最优
-            urls = [u for _, _, u in unique_candidates]
-            best_url = pick_best(urls)
+            groups[target_name] = unique_candidates
+        else:
+            print(f"✗ 未找到MV频道: {target_name}")
+    
+    # 测速选最优：所有频道的候选一次提交，上次选中的地址健康就直接沿用；
+    # 设置了 FAILOVER_URLS 时每个频道按排名连续输出前 N 个可用地址
+    best_map = sticky_failover_many("EE-MV", {t: [u for _, _, u in c] for t, c in groups.items()})
+    
+    result = []
+    for target_name, unique_candidates in groups.items():
+        for best_url in best_map[target_name]:
             for n, e, u in unique_candidates:
                 if u == best_url:
                     ext = e
                     if n in LOGO_MAP:
                         ext = re.sub(r'tvg-logo="[^"]*"', f'tvg-logo="{LOGO_MAP[n]}"', ext)
                     result.append((target_name, ext, u))
-                    print(f"✓ 找到MV频道: {target_name}")
                     break
-        else:
-            print(f"✗ 未找到MV频道: {target_name}")
+        if best_map[target_name]:
+            print(f"✓ 找到MV频道: {target_name}")
     
     # 龙华频道排序
     non_lh = [x for x in result if not any(k in x[0] for k in LONGHUA_KEYWORDS)]
     lh = [x for x in result if any(k in x[0] for k in LONGHUA_KEYWORDS)]
     
-    print(f"MV频道加载完成，共 {len(result)} 个频道")
+    print(f"MV频道加载完成，共 {len({x[0] for x in result})} 个频道")
     return non_lh + lh
 
 # ===================== TW =====================
 
-def fetch_tw(lines):
-    parsed = parse_m3u("\n".join(lines))
-    
+def fetch_tw(channels):
     # 收集所有TW分组的频道
     temp_dict = {}  # key: 频道名, value: (name, ext, url)
-    for n, e, u in parsed:
-        if parse_group(e) == TW_SOURCE_GROUP:
+    for c in channels:
+        if c.group == TW_SOURCE_GROUP:
+            n, e, u = clean_name(c.name), c.extinf, c.url
             # 去掉「」及其内部内容
             cleaned_name = re.sub(r'「[^」]*」', '', n)
             cleaned_name = cleaned_name.strip()
@@ -398,31 +371,6 @@ def fetch_tw(lines):
     
     return result
 
-# ===================== 测速 =====================
-
-def check(url):
-    try:
-        t0 = time.time()
-        r = requests.get(url, timeout=5, stream=True)
-        if r.status_code == 200:
-            return url, time.time() - t0
-    except:
-        pass
-    return url, 999
-
-
-def pick_best(urls):
-    if not urls:
-        return None
-    best = None
-    best_t = 999
-    with ThreadPoolExecutor(max_workers=5) as ex:
-        for f in as_completed([ex.submit(check, u) for u in urls]):
-            u, t = f.result()
-            if t < best_t:
-                best, best_t = u, t
-    return best
-
 # ===================== 主程序 =====================
 
 def main():
@@ -430,19 +378,17 @@ def main():
     print("开始生成EE.m3u...")
     print("=" * 50)
 
-    content = download(SOURCE_URL)
-    if not content:
+    main_data = load_channels(SOURCE_URL, retry=3)
+    if not main_data:
         print("❌ 无法下载源文件")
-        return
-
-    lines = content.splitlines()
+        sys.exit(1)
 
     print("正在加载HK频道...")
     hk = load_gat()
-    print(f"HK频道加载完成，共 {len(hk)} 个")
+    print(f"HK频道加载完成，共 {len({n for n, _, _ in hk})} 个")
     
     print("正在加载TW频道...")
-    tw = fetch_tw(lines)
+    tw = fetch_tw(main_data)
     print(f"TW频道加载完成，共 {len(tw)} 个")
     
     print("正在加载MV频道...")
@@ -10,6 +10,9 @@ import time
 import copy
 import re
 
+from host_health import fetch_with_health
+from decoding import decode_bytes
+
 # =========================
 # EPG源列表
 # =========================
@@ -161,58 +164,55 @@ MANUAL_ID_MAP = {
 
 
 def download_epg(url, retry=3):
-    """下载EPG，自动识别gzip / xml"""
+    """下载EPG，自动识别gzip / xml；主机熔断中直接跳过"""
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
     }
 
-    for i in range(retry):
-        try:
-            print(f"正在下载: {url}")
-            response = requests.get(
-                url,
-                timeout=60,
-                headers=headers,
-                allow_redirects=True
-            )
-            response.raise_for_status()
-
-            content = response.content
-            final_url = response.url
-            content_type = response.headers.get("Content-Type", "").lower()
-            encoding = response.headers.get("Content-Encoding", "").lower()
-
-            is_gzip = False
-            if final_url.endswith(".gz"):
-                is_gzip = True
-            elif "gzip" in content_type or "gzip" in encoding:
-                is_gzip = True
-            elif len(content) >= 2 and content[:2] == b"\x1f\x8b":
-                is_gzip = True
-
-            if is_gzip:
-                try:
-                    with gzip.GzipFile(fileobj=BytesIO(content)) as f:
-                        content = f.read()
-                except Exception:
-                    content = gzip.decompress(content)
-
-            text = content.decode("utf-8", errors="ignore").strip()
-
-            if not text.startswith("<"):
-                idx = text.find("<")
-                if idx != -1:
-                    text = text[idx:]
-
-            print(f"  下载成功，大小: {len(text)} 字符，最终地址: {final_url}")
-            return text
-
-        except Exception as e:
-            print(f"  第{i + 1}次尝试失败: {e}")
-            time.sleep(2)
-
-    print(f"  × 下载失败: {url}")
-    return None
+    def attempt():
+        print(f"正在下载: {url}")
+        response = requests.get(
+            url,
+            timeout=60,
+            headers=headers,
+            allow_redirects=True
+        )
+        response.raise_for_status()
+
+        content = response.content
+        final_url = response.url
+        content_type = response.headers.get("Content-Type", "").lower()
+        encoding = response.headers.get("Content-Encoding", "").lower()
+
+        is_gzip = False
+        if final_url.endswith(".gz"):
+            is_gzip = True
+        elif "gzip" in content_type or "gzip" in encoding:
+            is_gzip = True
+        elif len(content) >= 2 and content[:2] == b"\x1f\x8b":
+            is_gzip = True
+
+        if is_gzip:
+            try:
+                with gzip.GzipFile(fileobj=BytesIO(content)) as f:
+                    content = f.read()
+            except Exception:
+                content = gzip.decompress(content)
+
+        text = decode_bytes(content).strip()
+
+        if not text.startswith("<"):
+            idx = text.find("<")
+            if idx != -1:
+                text = text[idx:]
+
+        print(f"  下载成功，大小: {len(text)} 字符，最终地址: {final_url}")
+        return text
+
+    text = fetch_with_health(url, attempt, retry)
+    if text is None:
+        print(f"  × 下载失败: {url}")
+    return text
 
 
 def normalize_text(s):
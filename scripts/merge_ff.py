@@ -3,9 +3,16 @@
 
 import requests
 import re
-import time
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from source_loader import load_sources
+from single_flight import shared_download
+from artefacts import resolve_artefact
+from host_health import fetch_with_health
+from m3u_parser import parse_m3u
+from playlist_stream import load_channels
+from decoding import response_text
+from prober import sticky_failover_many
 
 # ===================== 配置 =====================
 
@@ -61,88 +68,62 @@ def fix_logo(name, extinf):
 
 # ===================== 下载 =====================
 
+@shared_download
 def download(url, retry=2):
     headers = {"User-Agent": "Mozilla/5.0"}
-    for i in range(retry):
-        try:
-            r = requests.get(url, headers=headers, timeout=15)
-            if r.status_code == 200:
-                return r.text
-        except:
-            print(f"重试 {i+1} 失败: {url}")
-    print(f"跳过: {url}")
-    return ""
+    def attempt():
+        r = requests.get(url, headers=headers, timeout=15)
+        r.raise_for_status()
+        if r.status_code == 200:
+            return response_text(r)
+    text = fetch_with_health(url, attempt, retry)
+    if not text:
+        print(f"跳过: {url}")
+    return text or ""
 
 # ===================== 解析 =====================
 
-def parse_name(extinf):
-    return extinf.split(",", 1)[-1].strip()
-
-def parse_group(extinf):
-    m = re.search(r'group-title="([^"]*)"', extinf)
-    return m.group(1) if m else ""
-
-def parse_m3u(content):
-    lines = content.splitlines()
-    data, ext = [], None
-
-    for l in lines:
-        l = l.strip()
-        if l.startswith("#EXTINF"):
-            ext = l
-        elif l.startswith("http") and ext:
-            name = parse_name(ext)
-            if not any(x in name for x in BAD_KEYWORDS):
-                data.append((name, ext, l))
-    return data
-
-def parse_txt(content):
+def to_items(channels):
+    """Channel 记录 -> (name, extinf, url)，过滤广告类频道，TXT 源补一个默认 #EXTINF"""
     data = []
-    for l in content.splitlines():
-        if "," in l and "http" in l:
-            name, url = l.split(",", 1)
-            if not any(x in name for x in BAD_KEYWORDS):
-                ext = f'#EXTINF:-1 group-title="未知",{name.strip()}'
-                data.append((name.strip(), ext, url.strip()))
+    for c in channels:
+        if any(x in c.name for x in BAD_KEYWORDS):
+            continue
+        ext = c.extinf or f'#EXTINF:-1 group-title="未知",{c.name}'
+        data.append((c.name, ext, c.url))
     return data
 
+def parse_source(url, channels):
+    print("抓取:", url)
+    try:
+        return to_items(channels)
+    except:
+        print("解析失败:", url)
+        return []
+
 def load_extra():
     all_data = []
-    for url in EXTRA_URLS:
-        print("抓取:", url)
-        raw = download(url)
-        if not raw:
-            continue
-        try:
-            if "#EXTINF" in raw:
-                all_data += parse_m3u(raw)
-            else:
-                all_data += parse_txt(raw)
-        except:
-            print("解析失败:", url)
+    for url, items in load_sources(EXTRA_URLS, load_channels, parse_source):
+        if items:
+            all_data += items
     return all_data
 
 # ===================== ⭐ CHC 专用（新增） =====================
 
 def load_chc_from_shanghai():
     url = "https://github.chenc.dev/raw.githubusercontent.com/CKL1211/eric/refs/heads/master/MyIPTV.m3u"
-    raw = download(url)
-    data = parse_m3u(raw)
+    data = load_channels(url)
 
     result = []
 
-    for n, e, u in data:
-        if parse_group(e) != "上海":
-            continue
-
-        m = re.search(r'tvg-name="([^"]+)"', e)
-        if not m:
+    for c in data:
+        if c.group != "上海":
             continue
 
-        tvg_name = m.group(1).strip()
+        tvg_name = c.attrs.get("tvg-name", "").strip()
 
         if tvg_name in CHC_TARGET:
-            result.append((tvg_name, e, u))
+            result.append((tvg_name, c.extinf, c.url))
 
     return result
 
@@ -163,41 +144,19 @@ def set_group(extinf, group):
         return re.sub(r'group-title="[^"]*"', f'group-title="{group}"', extinf)
     return extinf.replace("#EXTINF:-1", f'#EXTINF:-1 group-title="{group}"')
 
-# ===================== 并发测速 =====================
-
-def check(url):
-    try:
-        start = time.time()
-        r = requests.get(url, timeout=5, stream=True, headers={"User-Agent": "Mozilla/5.0"})
-        if r.status_code == 200:
-            return url, time.time() - start
-    except:
-        pass
-    return url, 999
-
-def pick_best(urls):
-    best_url, best_time = None, 999
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(check, u) for u in urls]
-        for f in as_completed(futures):
-            url, t = f.result()
-            if t < best_time:
-                best_time, best_url = t, url
-    return best_url
-
 # ===================== 主程序 =====================
 
 def main():
     print("主源...")
-    main_data = parse_m3u(download(SOURCE_URL))
+    main_data = load_channels(SOURCE_URL)
 
     print("TW...")
-    tw_data = parse_m3u(download(TW_M3U_URL))
+    tw_data = to_items(parse_m3u(resolve_artefact(TW_M3U_URL, download)))
 
     print("扩展源...")
     extra_data = load_extra()
 
-    hk = dedup([x for x in main_data if HK_SOURCE_GROUP in x[1]])
+    hk = dedup(to_items(c for c in main_data if HK_SOURCE_GROUP in c.group))
     tw = dedup(tw_data)
 
     # 央视
@@ -206,13 +165,6 @@ def main():
         if n in CCTV_TARGET:
             cctv_map.setdefault(n, []).append((e, u))
 
-    cctv = []
-    for name in CCTV_TARGET:
-        if name in cctv_map:
-            best = pick_best([u for _, u in cctv_map[name]])
-            ext = cctv_map[name][0][0]
-            cctv.append((name, ext, best))
-
     # ⭐ CHC（只从上海源）
     chc_raw = load_chc_from_shanghai()
 
@@ -220,12 +172,24 @@ def main():
     for n, e, u in chc_raw:
         chc_map.setdefault(n, []).append((e, u))
 
+    # 测速：央视 + CHC 所有候选一次提交，上次选中的地址健康就直接沿用；
+    # 设置了 FAILOVER_URLS 时每个频道连续输出前 N 个可用地址
+    best_map = sticky_failover_many("Gather", {
+        **{("cctv", n): [u for _, u in cctv_map[n]] for n in CCTV_TARGET if n in cctv_map},
+        **{("chc", n): [u for _, u in chc_map[n]] for n in CHC_TARGET if n in chc_map},
+    })
+
+    cctv = []
+    for name in CCTV_TARGET:
+        if name in cctv_map:
+            ext = cctv_map[name][0][0]
+            cctv.append((name, ext, best_map[("cctv", name)]))
+
     chc = []
     for name in CHC_TARGET:
         if name in chc_map:
-            best = pick_best([u for _, u in chc_map[name]])
             ext = chc_map[name][0][0]
-            chc.append((name, ext, best))
+            chc.append((name, ext, best_map[("chc", name)]))
 
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -246,14 +210,17 @@ def main():
     except:
         pass
 
+    # 全部候选都失败的频道照旧输出一条空地址
     out += "# 数字\n"
-    for n, e, u in cctv:
-        out += (set_group(e, "数字") or "") + "\n" + (u or "") + "\n"
+    for n, e, urls in cctv:
+        for u in urls or [""]:
+            out += (set_group(e, "数字") or "") + "\n" + u + "\n"
 
     out += "\n# CHC\n"
-    for n, e, u in chc:
+    for n, e, urls in chc:
         e = fix_logo(n, e)
-        out += (set_group(e, "CHC") or "") + "\n" + (u or "") + "\n"
+        for u in urls or [""]:
+            out += (set_group(e, "CHC") or "") + "\n" + u + "\n"
 
     out += "\n# HK\n"
     for n, e, u in hk:
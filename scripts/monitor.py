@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已发布播放列表的常驻巡检
+
+new.m3u 只在定时任务（每天 09:00 / 22:00）里重新生成，中间失效的地址要挂到下一次运行。
+这个进程常驻运行，按滚动节奏（MONITOR_INTERVAL 内把所有已发布地址均匀地各测一遍）用
+new.py 的 test_stream 复测；地址连续 CONFIRM_FAILURES 次不可播时，从 probe_store 记录的
+该频道排名候选里依次测出下一个可用地址换上，只重写受影响的那个输出文件（原子替换）。
+
+用法：python scripts/monitor.py [输出文件 ...]，默认巡检 OUTPUTS 里的全部文件
+"""
+
+import os
+import sys
+import time
+import asyncio
+import aiohttp
+
+import reachability
+from artefacts import ROOT_DIR, write_atomic
+from m3u_parser import parse_extinf
+from probe_store import STORE, canonical_url
+from rate_limit import scheduler
+from new import test_stream
+
+# 巡检的输出文件（相对仓库根目录）-> 生成脚本在 probe_store 里的 scope
+OUTPUTS = {"new.m3u": "new"}
+# 所有已发布地址测完一轮的时间（秒），可用环境变量 MONITOR_INTERVAL 调整
+MONITOR_INTERVAL = int(os.environ.get("MONITOR_INTERVAL", 15 * 60))
+# 连续失败几次才算失效，偶尔一次超时不换
+CONFIRM_FAILURES = 2
+# 每个失效地址最多试几个候选
+MAX_REPLACEMENT_TRIES = 5
+
+
+def read_published(path):
+    """[(行号, 频道, 地址)]，频道取 tvg-name，没有时用显示名"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().split("\n")
+    except OSError:
+        return []
+    entries = []
+    channel = None
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if line.startswith("#EXTINF"):
+            attrs, name = parse_extinf(line)
+            channel = attrs.get("tvg-name") or name
+        elif line and not line.startswith("#") and channel:
+            entries.append((i, channel, line))
+            channel = None
+    return entries
+
+
+def replace_line(path, lineno, old, new):
+    """第 lineno 行的 old 换成 new 后原子写回；文件已经重新生成过（该行不再是 old）时放弃"""
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    if lineno >= len(lines) or lines[lineno].strip() != old:
+        return False
+    lines[lineno] = new
+    write_atomic(path, "\n".join(lines))
+    return True
+
+
+async def recheck(session, url):
+    """实际复测（不用有效期内的缓存），结果写入测速记录；返回是否可播"""
+    async with scheduler().slot(url):
+        strict_ok, fallback_ok, latency, headroom, fingerprint = await test_stream(session, url)
+    STORE.put(url, "stream", latency, strict=strict_ok, fallback=fallback_ok, headroom=headroom,
+              fingerprint=fingerprint)
+    return fallback_ok
+
+
+async def is_dead(session, url):
+    for _ in range(CONFIRM_FAILURES):
+        if await recheck(session, url):
+            return False
+        # 确认时重新连接，不沿用刚才 TCP 预检的失败结果
+        reachability.forget(url)
+    return True
+
+
+async def find_replacement(session, scope, channel, published):
+    """按上次排名依次测还没发布的候选，返回第一个可播的，没有返回 None"""
+    tried = 0
+    for url in STORE.candidates(scope, channel):
+        if canonical_url(url) in published:
+            continue
+        if tried >= MAX_REPLACEMENT_TRIES:
+            break
+        tried += 1
+        if await recheck(session, url):
+            return url
+    return None
+
+
+async def check_entry(session, path, scope, lineno, channel, url):
+    if not await is_dead(session, url):
+        return
+    published = {canonical_url(u) for _, _, u in read_published(path)}
+    new_url = await find_replacement(session, scope, channel, published)
+    name = os.path.relpath(path, ROOT_DIR)
+    if new_url is None:
+        print(f"✗ {channel} 已失效，没有可替换的候选: {url}")
+        return
+    if not replace_line(path, lineno, url, new_url):
+        return
+    winner = STORE.winner(scope, channel)
+    if winner and canonical_url(winner) == canonical_url(url):
+        STORE.set_winner(scope, channel, new_url)
+    STORE.flush()
+    print(f"↻ {channel}: {url} -> {new_url}（已更新 {name}）")
+
+
+async def monitor(outputs, interval=MONITOR_INTERVAL):
+    """outputs: {输出文件绝对路径: scope}；一直运行，每轮把所有已发布地址在 interval 内均匀测一遍"""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=45)) as session:
+        while True:
+            start = time.time()
+            # 连通性预检的结果在进程内一直有效，每轮重新检查，否则一次连不上的主机永远被判失败
+            reachability.reset()
+            work = [(path, scope) + e for path, scope in outputs.items() for e in read_published(path)]
+            if not work:
+                print("没有可巡检的地址，稍后再试")
+                await asyncio.sleep(interval)
+                continue
+            gap = interval / len(work)
+            for i, item in enumerate(work):
+                try:
+                    await check_entry(session, *item)
+                except Exception as e:
+                    print(f"巡检 {item[3]} 出错: {e}")
+                delay = start + (i + 1) * gap - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            STORE.flush()
+            print(f"本轮巡检完成: {len(work)} 个地址，用时 {time.time() - start:.0f} 秒")
+
+
+def main():
+    # 常驻运行：每次写入立即提交，同时运行的 new.py 不会因为写锁被占着而丢掉结果
+    STORE.commit_every = 1
+    names = sys.argv[1:] or list(OUTPUTS)
+    outputs = {}
+    for name in names:
+        if name not in OUTPUTS:
+            print(f"不支持巡检的文件: {name}（可选: {', '.join(OUTPUTS)}）")
+            continue
+        outputs[os.path.join(ROOT_DIR, name)] = OUTPUTS[name]
+    if not outputs:
+        return
+    print(f"开始巡检: {', '.join(os.path.relpath(p, ROOT_DIR) for p in outputs)}，每轮 {MONITOR_INTERVAL} 秒")
+    try:
+        asyncio.run(monitor(outputs))
+    except KeyboardInterrupt:
+        print("巡检结束")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,36 @@
 
 import re
 import time
+import hashlib
+import random
 import asyncio
 import aiohttp
+from collections import deque
 from urllib.parse import urljoin
 from datetime import datetime
 
+from source_loader import load_sources_async
+from single_flight import PROBES
+from probe_store import STORE, canonical_url, unique_urls
+from prober import EXPLORE_RATE, FAILOVER_URLS
+from reachability import reachable, CONNECT_TIMEOUT
+from rate_limit import scheduler
+from playlist_stream import afetch_channels
+from decoding import decode_bytes
+from artefacts import write_atomic
+
 OUTPUT_FILE = "new.m3u"
 TEST_TIMEOUT = 10
 PLAYLIST_TIMEOUT = 8
 SEGMENT_TIMEOUT = 8
+# HLS 吞吐测速：单个分片最多下载的字节数、选档时的码率上限（bps）
+SEGMENT_BYTE_CAP = 2 * 1024 * 1024
+VARIANT_MAX_BANDWIDTH = 8_000_000
+# 吞吐余量（实测吞吐 / 码率）低于这个值的候选排在后面；计算排名时余量最多按 3 倍算
+MIN_HEADROOM = 1.2
+HEADROOM_CAP = 3.0
+# 内容指纹取首个分片的前这么多字节（不足时要求分片完整）
+FINGERPRINT_BYTES = 64 * 1024
 LOGO_BASE = "https://raw.githubusercontent.com/xiasufern/AA/main/icon/"
 SAT_LOGO_BASE = "http://epg.51zmt.top:8000/tb1/ws/"
 BLOCKED_SOURCE_KEYWORDS = ["iptv.catvod.com"]
@@ -162,11 +183,42 @@ def normalize_text(text):
                 .replace("＋", "+").replace("４ｋ", "4k").replace("4Ｋ", "4k"))
     return text.replace(" ", "").replace("-", "").replace("_", "")
 
-def is_alias_match(norm_name, alias):
-    a = normalize_text(alias)
-    if re.fullmatch(r"cctv\d+", a):
-        return re.search(rf"{re.escape(a)}(?!\d)", norm_name) is not None
-    return a in norm_name
+def build_alias_index():
+    """
+    MATCH_ORDER 里所有频道的别名（规范化后）建一个 Aho-Corasick 自动机，导入时建一次。
+    返回 (子结点, 失败指针, 输出)，输出为在该结点结束的 [(优先级, 标准名, 后面不能跟数字)]，
+    优先级即频道在 MATCH_ORDER 里的位置；cctv+数字 形式的别名要求后面不是数字（cctv1 不匹配 cctv13）
+    """
+    children, fail, out = [{}], [0], [[]]
+    for priority, std_name in enumerate(MATCH_ORDER):
+        for alias in CHANNEL_SPECS.get(std_name, {}).get("aliases", []):
+            a = normalize_text(alias)
+            if not a:
+                continue
+            node = 0
+            for ch in a:
+                nxt = children[node].get(ch)
+                if nxt is None:
+                    nxt = children[node][ch] = len(children)
+                    children.append({})
+                    fail.append(0)
+                    out.append([])
+                node = nxt
+            out[node].append((priority, std_name, re.fullmatch(r"cctv\d+", a) is not None))
+
+    queue = deque(children[0].values())
+    while queue:
+        node = queue.popleft()
+        for ch, nxt in children[node].items():
+            f = fail[node]
+            while f and ch not in children[f]:
+                f = fail[f]
+            fail[nxt] = children[f].get(ch, 0)
+            out[nxt] = out[nxt] + out[fail[nxt]]
+            queue.append(nxt)
+    return children, fail, out
+
+ALIAS_INDEX = build_alias_index()
 
 def is_hk_name_valid(std_name, raw_name):
     n = normalize_text(raw_name)
@@ -181,13 +233,23 @@ def is_hk_name_valid(std_name, raw_name):
     return True
 
 def match_target(name):
+    """频道名扫一遍自动机找出所有命中的别名，按 MATCH_ORDER 的优先级取第一个（凤凰台还要过名称校验）"""
     norm_name = normalize_text(name)
-    for std_name in MATCH_ORDER:
-        for alias in CHANNEL_SPECS.get(std_name, {}).get("aliases", []):
-            if is_alias_match(norm_name, alias):
-                if std_name in HK_ORDER and not is_hk_name_valid(std_name, name):
-                    continue
-                return std_name
+    children, fail, out = ALIAS_INDEX
+    found = set()
+    node = 0
+    for i, ch in enumerate(norm_name):
+        while node and ch not in children[node]:
+            node = fail[node]
+        node = children[node].get(ch, 0)
+        for priority, std_name, digit_boundary in out[node]:
+            if digit_boundary and i + 1 < len(norm_name) and norm_name[i + 1].isdecimal():
+                continue
+            found.add((priority, std_name))
+    for _, std_name in sorted(found):
+        if std_name in HK_ORDER and not is_hk_name_valid(std_name, name):
+            continue
+        return std_name
     return None
 
 def get_logo_url(std_name):
@@ -216,39 +278,23 @@ def is_blocked_source(url):
 def contains_date(text):
     return re.search(r"\d{4}-\d{2}-\d{2}", text or "") is not None
 
-def extract_urls_from_txt(content):
-    res = []
-    for line in content.splitlines():
-        line = line.strip()
-        if line and "," in line:
-            a = line.split(",", 1)
-            if len(a) == 2:
-                res.append((a[0].strip(), a[1].strip()))
-    return res
-
-def extract_urls_from_m3u(content):
-    res, ch = [], "Unknown"
-    for line in content.splitlines():
-        line = line.strip()
-        if line.startswith("#EXTINF:"):
-            p = line.split(",", 1)
-            ch = p[1].strip() if len(p) > 1 else "Unknown"
-        elif line.startswith(("http://", "https://")):
-            res.append((ch, line))
-    return res
+def host_timeout(url, default):
+    """按主机历史延迟调整连接/读取超时，总超时至少为 default，慢的主机跟着读取超时放宽；样本不足时只用 default"""
+    connect, read = STORE.timeouts(url, default, "stream")
+    return aiohttp.ClientTimeout(total=max(default, read), sock_connect=connect, sock_read=read)
 
 async def fetch_text(session, url, timeout=PLAYLIST_TIMEOUT):
     try:
-        async with session.get(url, timeout=timeout, allow_redirects=True) as r:
+        async with session.get(url, timeout=host_timeout(url, timeout), allow_redirects=True) as r:
             if r.status != 200:
                 return None
-            return await r.text(errors="ignore")
+            return decode_bytes(await r.read())
     except:
         return None
 
 async def fetch_head_bytes(session, url, timeout=SEGMENT_TIMEOUT):
     try:
-        async with session.get(url, timeout=timeout, headers={"Range": "bytes=0-1023"}, allow_redirects=True) as r:
+        async with session.get(url, timeout=host_timeout(url, timeout), headers={"Range": "bytes=0-1023"}, allow_redirects=True) as r:
             if r.status not in (200, 206):
                 return False
             return len(await r.read()) > 0
@@ -257,7 +303,7 @@ async def fetch_head_bytes(session, url, timeout=SEGMENT_TIMEOUT):
 
 async def probe_http_alive(session, url, timeout=SEGMENT_TIMEOUT):
     try:
-        async with session.get(url, timeout=timeout, headers={"Range": "bytes=0-255"}, allow_redirects=True) as r:
+        async with session.get(url, timeout=host_timeout(url, timeout), headers={"Range": "bytes=0-255"}, allow_redirects=True) as r:
             if r.status not in (200, 206):
                 return False
             return len(await r.read()) > 0
@@ -267,124 +313,309 @@ async def probe_http_alive(session, url, timeout=SEGMENT_TIMEOUT):
 def parse_m3u8_lines(text):
     return [x.strip() for x in (text or "").splitlines() if x.strip()]
 
-def first_non_comment_uri(lines):
+def parse_stream_inf(lines):
+    """主播放列表里的 [(BANDWIDTH, 子列表 URI)]"""
+    variants = []
+    bandwidth = None
     for x in lines:
-        if not x.startswith("#"):
-            return x
-    return None
+        if x.startswith("#EXT-X-STREAM-INF"):
+            m = re.search(r"(?<![A-Z-])BANDWIDTH=(\d+)", x)
+            bandwidth = int(m.group(1)) if m else 0
+        elif not x.startswith("#") and bandwidth is not None:
+            variants.append((bandwidth, x))
+            bandwidth = None
+    return variants
+
+def pick_variant(variants):
+    """不超过 VARIANT_MAX_BANDWIDTH 的最高码率档，都超过时取最低档"""
+    if not variants:
+        return None
+    fit = [v for v in variants if v[0] <= VARIANT_MAX_BANDWIDTH]
+    return max(fit) if fit else min(variants)
+
+def first_segment(lines):
+    """媒体播放列表的第一个分片 (时长秒数或 None, URI)"""
+    duration = None
+    for x in lines:
+        if x.startswith("#EXTINF:"):
+            try:
+                duration = float(x[8:].split(",", 1)[0])
+            except ValueError:
+                duration = None
+        elif not x.startswith("#"):
+            return duration, x
+    return None, None
+
+async def measure_segment(session, url, cap=SEGMENT_BYTE_CAP, timeout=SEGMENT_TIMEOUT):
+    """
+    下载一个分片（最多 cap 字节），返回 (字节数, 响应头到达之后的传输耗时, 是否完整, 内容指纹或 None)；失败返回 None。
+    内容指纹是前 FINGERPRINT_BYTES 字节的 SHA-1，转发同一个上游的不同地址在同一时刻拿到的分片相同
+    """
+    try:
+        async with session.get(url, timeout=host_timeout(url, timeout), allow_redirects=True) as r:
+            if r.status not in (200, 206):
+                return None
+            # 从响应头到达开始计时：从第一块数据开始算的话，整段一两块就到齐的分片耗时接近 0，
+            # 第一块的字节却算进了吞吐，余量会被严重高估
+            start = time.time()
+            size = 0
+            complete = False
+            digest = hashlib.sha1()
+            try:
+                async for chunk in r.content.iter_chunked(64 * 1024):
+                    if size < FINGERPRINT_BYTES:
+                        digest.update(chunk[:FINGERPRINT_BYTES - size])
+                    size += len(chunk)
+                    if size >= cap:
+                        break
+                else:
+                    complete = True
+            except asyncio.TimeoutError:
+                pass
+            if not size:
+                return None
+            fingerprint = digest.hexdigest() if size >= FINGERPRINT_BYTES or complete else None
+            return size, time.time() - start, complete, fingerprint
+    except:
+        return None
+
+def segment_headroom(measured, bandwidth, duration):
+    """吞吐余量 = 实测吞吐 / 码率；码率优先用 BANDWIDTH，没有时用完整分片大小 / 时长估算"""
+    size, elapsed, complete, _ = measured
+    if not bandwidth and complete and duration:
+        bandwidth = size * 8 / duration
+    if not bandwidth:
+        return None
+    throughput = size * 8 / max(elapsed, 1e-3)
+    return throughput / bandwidth
 
 async def sniff_m3u8_playable(session, url):
+    """返回 (可播放, 吞吐余量或 None, 分片传输耗时, 内容指纹或 None)"""
     text = await fetch_text(session, url)
     if not text or "#EXTM3U" not in text:
-        return False
+        return False, None, 0, None
     lines = parse_m3u8_lines(text)
+    playlist_url, bandwidth = url, None
 
     if any("#EXT-X-STREAM-INF" in x for x in lines):
-        child = first_non_comment_uri(lines)
-        if not child:
-            return False
-        child_url = urljoin(url, child)
-        text2 = await fetch_text(session, child_url)
+        variant = pick_variant(parse_stream_inf(lines))
+        if not variant:
+            return False, None, 0, None
+        bandwidth, child = variant
+        playlist_url = urljoin(url, child)
+        text2 = await fetch_text(session, playlist_url)
         if not text2 or "#EXTM3U" not in text2:
-            return False
-        seg = first_non_comment_uri(parse_m3u8_lines(text2))
-        if not seg:
-            return False
-        return await fetch_head_bytes(session, urljoin(child_url, seg))
+            return False, None, 0, None
+        lines = parse_m3u8_lines(text2)
 
-    seg = first_non_comment_uri(lines)
+    duration, seg = first_segment(lines)
     if not seg:
-        return False
-    return await fetch_head_bytes(session, urljoin(url, seg))
+        return False, None, 0, None
+    measured = await measure_segment(session, urljoin(playlist_url, seg))
+    if not measured:
+        return False, None, 0, None
+    return True, segment_headroom(measured, bandwidth, duration), measured[1], measured[3]
 
 async def sniff_stream_strict(session, url):
     if ".m3u8" in url.lower():
         return await sniff_m3u8_playable(session, url)
-    return await fetch_head_bytes(session, url)
+    return await fetch_head_bytes(session, url), None, 0, None
 
 async def sniff_stream_fallback(session, url):
     return await probe_http_alive(session, url)
 
 async def test_stream(session, url):
+    """返回 (严格可播, 兜底可播, 延迟, 吞吐余量, 内容指纹)；延迟不含分片下载时间。TCP 预检连不上的直接判失败"""
+    if not await reachable(url, STORE.timeouts(url, CONNECT_TIMEOUT, "stream")[0]):
+        return False, False, None, None, None
     start = time.time()
     try:
-        if await sniff_stream_strict(session, url):
-            return True, True, time.time() - start
+        ok, headroom, transfer, fingerprint = await sniff_stream_strict(session, url)
+        if ok:
+            return True, True, time.time() - start - transfer, headroom, fingerprint
     except:
         pass
     try:
         if await sniff_stream_fallback(session, url):
-            return False, True, time.time() - start
+            return False, True, time.time() - start, None, None
     except:
         pass
-    return False, False, None
-
-async def read_and_test_file(url, is_m3u):
+    return False, False, None, None, None
+
+async def test_stream_cached(session, url):
+    """有效期内测过的地址直接用共享测速记录，否则测速并写入"""
+    cached = STORE.get(url, "stream")
+    if cached is not None and cached["fallback"] is not None:
+        return bool(cached["strict"]), bool(cached["fallback"]), cached["latency"], cached["headroom"]
+    async with scheduler().slot(url):
+        strict_ok, fallback_ok, latency, headroom, fingerprint = await test_stream(session, url)
+    STORE.put(url, "stream", latency, strict=strict_ok, fallback=fallback_ok, headroom=headroom,
+              fingerprint=fingerprint)
+    return strict_ok, fallback_ok, latency, headroom
+
+def test_stream_once(session, url):
+    return PROBES.do_async(("test_stream", canonical_url(url)), test_stream_cached, session, url)
+
+async def _probe_representative(session, url):
+    return canonical_url(url), await test_stream_once(session, url)
+
+async def test_stream_dedup(session, std, url):
+    """
+    同源镜像只测一个代表：同一频道里上次测速指纹相同的地址，本次运行只有最先到达的那个真正测速，
+    代表严格可播时其余镜像直接跳过（返回 None）；代表测不通或只能兜底时可能只是那个转发有问题，
+    镜像照常单独测（有指纹说明镜像上次是严格可播的）
+    """
+    fingerprint = STORE.fingerprint(url)
+    if fingerprint:
+        rep, result = await PROBES.do_async(("origin", std, fingerprint), _probe_representative, session, url)
+        if rep == canonical_url(url):
+            return result
+        if result[0]:
+            return None
+    return await test_stream_once(session, url)
+
+async def verify_previous_winners(session):
+    """
+    热启动：上次选中的地址先验证，严格可播且吞吐余量足够的频道本次直接沿用，不再测其他候选；
+    每个频道以 EXPLORE_RATE 的概率跳过热启动，重新测全部候选
+    """
+    prev = {}
+    for std in OUTPUT_ORDER:
+        url = STORE.winner("new", std)
+        if url and random.random() >= EXPLORE_RATE:
+            prev[std] = url
+    tasks = [test_stream_dedup(session, std, u) for std, u in prev.items()]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    settled = {}
+    for (std, url), result in zip(prev.items(), results):
+        if result is None or isinstance(result, Exception):
+            continue
+        strict_ok, fallback_ok, latency, headroom = result
+        if strict_ok and (headroom is None or headroom >= MIN_HEADROOM):
+            settled[std] = (std, url, latency, strict_ok, headroom)
+    print(f"沿用上次选中的频道: {len(settled)}/{len(prev)}")
+    return settled
+
+async def test_source_entries(session, channels, settled=None):
+    """
+    返回 (可用地址 [(频道, 地址, 延迟, 严格可播, 吞吐余量)], 没有单独测速的地址 [(频道, 地址)])；
+    热启动已选定的频道只在需要备用地址（FAILOVER_URLS > 1）时才测其他候选，
+    不测的候选也返回，留给巡检进程（monitor.py）当替换候选
+    """
+    settled = settled or {}
     try:
-        if is_blocked_source(url):
-            print(f"跳过屏蔽源: {url}")
-            return []
-
-        timeout = aiohttp.ClientTimeout(total=45)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as r:
-                content = await r.text()
-
-            entries = extract_urls_from_m3u(content) if is_m3u else extract_urls_from_txt(content)
-
-            filtered = []
-            for ch, u in entries:
-                if contains_date(ch) or contains_date(u):
-                    continue
-                if is_blocked_source(u):
-                    continue
-                std = match_target(ch)
-                if std:
-                    filtered.append((std, u))
-
-            tasks = [test_stream(session, u) for _, u in filtered]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            valid = []
-            for result, (std, u) in zip(results, filtered):
-                if isinstance(result, Exception):
-                    continue
-                strict_ok, fallback_ok, latency = result
-                if fallback_ok:
-                    valid.append((std, u, latency, strict_ok))
-            return valid
+        entries = [(c.name, c.url) for c in channels]
+
+        filtered, spare = [], []
+        for ch, u in entries:
+            if contains_date(ch) or contains_date(u):
+                continue
+            if is_blocked_source(u):
+                continue
+            std = match_target(ch)
+            if not std:
+                continue
+            if std in settled and FAILOVER_URLS <= 1:
+                spare.append((std, u))
+            else:
+                filtered.append((std, u))
+
+        tasks = [test_stream_dedup(session, std, u) for std, u in filtered]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        valid = []
+        for result, (std, u) in zip(results, filtered):
+            if isinstance(result, Exception):
+                continue
+            if result is None:
+                # 和可播的代表同源，没有单独测，排在测过的地址后面当备用
+                spare.append((std, u))
+                continue
+            strict_ok, fallback_ok, latency, headroom = result
+            if fallback_ok:
+                valid.append((std, u, latency, strict_ok, headroom))
+        return valid, spare
     except:
-        return []
+        return [], []
+
+def known_dead(url):
+    cached = STORE.get(url, "stream")
+    return cached is not None and cached["latency"] is None
 
 async def fetch_best_channels():
-    all_valid = []
+    sources = []
     for s in SOURCES:
         if is_blocked_source(s):
             print(f"跳过屏蔽源: {s}")
             continue
-        is_m3u = s.endswith((".m3u", ".m3u8"))
-        print(f"抓取频道源: {s}")
-        all_valid.extend(await read_and_test_file(s, is_m3u))
+        sources.append(s)
+
+    # 所有源并发流式下载解析（按内容自动识别 M3U/TXT），某个源解析完成后立即开始测速
+    timeout = aiohttp.ClientTimeout(total=45)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # 上次选中的地址和订阅源下载同时验证，源解析完成时已经知道哪些频道不用再测
+        verify = asyncio.ensure_future(verify_previous_winners(session))
 
-    best_strict, best_fallback = {}, {}
-    for std, url, latency, strict_ok in all_valid:
+        async def fetch(url):
+            print(f"抓取频道源: {url}")
+            return await afetch_channels(session, url)
+
+        async def handle(url, channels):
+            return await test_source_entries(session, channels, await verify)
+
+        loaded = await load_sources_async(sources, fetch, handle)
+        settled = await verify
+
+    all_valid = list(settled.values())
+    spare = {}
+    for _, found in loaded:
+        if not found:
+            continue
+        valid, untested = found
+        all_valid.extend(valid)
+        for std, url in untested:
+            spare.setdefault(std, []).append(url)
+
+    # 严格可播的排在兜底保留的前面，同类按历史统计（EWMA/p50/p95/失败率）排序，没有历史时用本次延迟；
+    # HLS 吞吐余量不足的排在后面，余量越大分数越好（最多按 HEADROOM_CAP 倍算）
+    ranked = {}
+    for std, url, latency, strict_ok, headroom in all_valid:
         if latency is None:
             continue
-        if strict_ok and (std not in best_strict or latency < best_strict[std][1]):
-            best_strict[std] = (url, latency)
-        if std not in best_fallback or latency < best_fallback[std][1]:
-            best_fallback[std] = (url, latency)
-
+        score = STORE.score(url, "stream")
+        score = latency if score is None else score
+        if headroom is not None:
+            score = (not strict_ok, headroom < MIN_HEADROOM, score / min(max(headroom, 0.1), HEADROOM_CAP))
+        else:
+            score = (not strict_ok, False, score)
+        ranked.setdefault(std, {}).setdefault(canonical_url(url), (score, url, strict_ok))
+
+    # 每个频道输出排名前 FAILOVER_URLS 个地址（默认 1 个），当前地址失效时播放器可以直接切到下一条；
+    # 热启动沿用的地址固定排第一，没有单独测速的地址（同源镜像）排在测过的地址后面。
+    # 保存给巡检进程的候选再补上上次保存的候选，有效期内测过不可播的去掉，热启动时候选列表不会缩短
     result = []
     strict_count = fallback_count = 0
     for std in OUTPUT_ORDER:
-        if std in best_strict:
-            result.append((std, best_strict[std][0]))
+        if std not in ranked:
+            continue
+        ordered = sorted(ranked[std].values(), key=lambda x: x[0])
+        if std in settled:
+            winner = canonical_url(settled[std][1])
+            ordered.sort(key=lambda x: canonical_url(x[1]) != winner)
+        urls = unique_urls([url for _, url, _ in ordered] + spare.get(std, []))
+        STORE.set_candidates("new", std, [
+            url for url in unique_urls(urls + STORE.candidates("new", std)) if not known_dead(url)
+        ])
+        result.append((std, urls[:FAILOVER_URLS]))
+        if ordered[0][2]:
             strict_count += 1
-        elif std in best_fallback:
-            result.append((std, best_fallback[std][0]))
+        else:
             fallback_count += 1
 
+    for std, urls in result:
+        STORE.set_winner("new", std, urls[0])
+
     print("已获取频道总数:", len(result))
     print("其中严格可播:", strict_count)
     print("其中兜底保留:", fallback_count)
@@ -392,12 +623,14 @@ async def fetch_best_channels():
 
 def generate_output(channels, filename):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(filename, "w", encoding="utf-8") as out:
-        out.write("#EXTM3U\n\n")
-        out.write(f"# new.m3u\n# 生成时间: {ts}\n\n")
-        for std, url in channels:
-            out.write(build_extinf(std) + "\n")
-            out.write(url + "\n")
+    out = "#EXTM3U\n\n"
+    out += f"# new.m3u\n# 生成时间: {ts}\n\n"
+    for std, urls in channels:
+        for url in urls:
+            out += build_extinf(std) + "\n"
+            out += url + "\n"
+    # 巡检进程（monitor.py）可能同时在读写这个文件
+    write_atomic(filename, out)
     print(f"✅ {filename} 生成完成")
 
 def main():
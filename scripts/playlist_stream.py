@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+边下载边解析播放列表
+
+直接从 HTTP 响应按行读取（requests 的 iter_lines / aiohttp 的 StreamReader），
+每读到一行就交给 PlaylistReader，需要的分组在流里过滤，
+iptv.catvod.com 这类大型聚合列表不会再以完整文本 + splitlines 的形式留在内存里。
+"""
+
+import requests
+
+from m3u_parser import PlaylistReader, DEFAULT_SCHEMES
+from decoding import LineDecoder
+from single_flight import PARSED
+from host_health import fetch_with_health, fetch_with_health_async
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+TIMEOUT = 15
+CHUNK_SIZE = 64 * 1024
+
+
+def stream_channels(url, groups=None, schemes=DEFAULT_SCHEMES, timeout=TIMEOUT, headers=None):
+    """生成器：边下载边产出 Channel；HTTP 错误抛异常"""
+    with requests.get(url, headers=headers or HEADERS, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        reader = PlaylistReader(schemes, groups)
+        decode_line = LineDecoder()
+        for raw in r.iter_lines(chunk_size=CHUNK_SIZE):
+            for c in reader.feed(decode_line(raw)):
+                yield c
+        for c in reader.close():
+            yield c
+
+
+def fetch_channels(url, groups=None, schemes=DEFAULT_SCHEMES, retry=2, timeout=TIMEOUT, headers=None):
+    """流式下载并解析，只保留 groups 内的频道（不缓存）；失败返回 []"""
+    def attempt():
+        return list(stream_channels(url, groups, schemes, timeout, headers))
+    return fetch_with_health(url, attempt, retry) or []
+
+
+def load_channels(url, schemes=DEFAULT_SCHEMES, retry=2, timeout=TIMEOUT):
+    """
+    流式下载并解析整个播放列表，只保留 Channel 记录不保留原文；
+    同一 URL 本次运行只下载解析一次，多个脚本/阶段共享。返回列表副本。
+    """
+    return list(PARSED.do(("channels", url, schemes), fetch_channels, url, None, schemes, retry, timeout))
+
+
+async def astream_channels(response, groups=None, schemes=DEFAULT_SCHEMES):
+    """aiohttp 版本：按块读取 response.content，切成行后产出 Channel"""
+    reader = PlaylistReader(schemes, groups)
+    decode_line = LineDecoder()
+    buf = b""
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for raw in lines:
+            for c in reader.feed(decode_line(raw)):
+                yield c
+    if buf:
+        for c in reader.feed(decode_line(buf)):
+            yield c
+    for c in reader.close():
+        yield c
+
+
+async def afetch_channels(session, url, groups=None, schemes=DEFAULT_SCHEMES):
+    """aiohttp 流式下载并解析；失败返回 []"""
+    async def attempt():
+        async with session.get(url) as r:
+            r.raise_for_status()
+            if r.status != 200:
+                return None
+            return [c async for c in astream_channels(r, groups, schemes)]
+    return await fetch_with_health_async(url, attempt) or []
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化的测速结果表
+
+所有脚本共用一个 SQLite 文件（代替 auto.py 私有的 speed_cache.json）：
+按 (规范化 URL, 测速类型) 记录延迟、HTTP 状态、严格/兜底可播放结果、HLS 吞吐余量和时间戳，
+在有效期内的结果直接复用，不再每个脚本各测一遍。
+写入按批提交，不再每次运行整份 json 重写；超过上限时按最近使用时间淘汰。
+
+每次实际测速的结果还会累积进 stats 表（按地址、按主机各一行）：延迟 EWMA、失败率 EWMA
+和最近若干次成功延迟（用于 p50/p95）。选源时按 score() 排序，一次偶然快/慢的测速
+不会让选中的地址在两次运行之间来回跳。
+
+HLS 测速还会记下首个分片的内容指纹：不同地址指纹相同说明转发的是同一个上游，
+之后的运行同一指纹只测一个代表（见 new.py test_stream_dedup）。
+
+winners 表记录每个生成脚本（scope）里每个频道上次选中的地址，下次运行先验证它，
+健康就直接沿用（见 prober.sticky_many / new.py）；candidates 表记录每个频道按排名排列的
+全部可用地址，发布的地址失效时巡检进程从这里挑下一个（见 monitor.py）。
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+from host_health import host_of
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 可用环境变量 PROBE_STORE 指向别的文件（基准测试用临时文件，不污染真实记录）
+STORE_FILE = os.environ.get("PROBE_STORE") or os.path.join(SCRIPT_DIR, "probe_store.sqlite")
+
+# 成功结果的有效期（秒），可用环境变量 PROBE_TTL 调整
+TTL = int(os.environ.get("PROBE_TTL", 6 * 3600))
+# 失败结果的有效期：短一些，临时故障的地址下次运行还有机会
+FAIL_TTL = int(os.environ.get("PROBE_FAIL_TTL", 3600))
+# 超过 7 天没有重新测过的记录直接删除
+STALE_AFTER = 7 * 24 * 3600
+# 最多保留的记录数，超出按最近使用时间淘汰
+MAX_ROWS = 20000
+# 每积累多少次写入提交一次；常驻进程（monitor.py）设为 1，不长时间占着写锁
+COMMIT_EVERY = 200
+# 另一个进程正在写时最多等多久（毫秒）；new.py 和巡检进程可能同时写同一个文件
+BUSY_TIMEOUT_MS = 30000
+# 统计：EWMA 系数、保留的最近成功延迟个数、超过 30 天没更新的统计删除
+STATS_ALPHA = 0.3
+RECENT_SAMPLES = 20
+STATS_STALE_AFTER = 30 * 24 * 3600
+# 自适应超时：连接超时取主机 p50、读取超时取主机 p95 的 TIMEOUT_FACTOR 倍，都不低于下限；
+# 连接超时不超过调用方原来的固定超时，读取超时最多放宽到它的 READ_CEILING 倍（慢但能用的转发
+# 不再被固定超时切断）；主机样本不足时直接用固定超时
+TIMEOUT_FACTOR = 3.0
+CONNECT_FLOOR = 1.0
+READ_FLOOR = 2.0
+READ_CEILING = 2.0
+TIMEOUT_MIN_SAMPLES = 5
+# 内容指纹的可信期：超过这个时间没有重新测过的地址不再参与同源合并，下次单独测一次
+FINGERPRINT_TTL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    url       TEXT NOT NULL,
+    kind      TEXT NOT NULL,
+    latency   REAL,
+    status    INTEGER,
+    strict    INTEGER,
+    fallback  INTEGER,
+    probed_at REAL NOT NULL,
+    used_at   REAL NOT NULL,
+    headroom  REAL,
+    fingerprint TEXT,
+    PRIMARY KEY (url, kind)
+)
+"""
+
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    key        TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    n          INTEGER NOT NULL,
+    ewma       REAL,
+    fail_rate  REAL NOT NULL,
+    recent     TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (key, kind)
+)
+"""
+
+WINNERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS winners (
+    scope      TEXT NOT NULL,
+    channel    TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    chosen_at  REAL NOT NULL,
+    PRIMARY KEY (scope, channel)
+)
+"""
+
+CANDIDATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candidates (
+    scope      TEXT NOT NULL,
+    channel    TEXT NOT NULL,
+    urls       TEXT NOT NULL,
+    ranked_at  REAL NOT NULL,
+    PRIMARY KEY (scope, channel)
+)
+"""
+
+FIELDS = ("latency", "status", "strict", "fallback", "headroom", "fingerprint", "probed_at")
+
+
+def percentile(values, q):
+    """最近邻法取百分位，values 已排序"""
+    if not values:
+        return None
+    idx = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[idx]
+
+
+def canonical_url(url):
+    """
+    测速去重用的键：协议、主机名小写，去掉默认端口和 #fragment，查询参数按原样排序。
+    只用来识别“同一个流”，实际请求仍然用原地址。
+    """
+    try:
+        p = urlsplit(url.strip())
+        port = p.port
+    except ValueError:
+        return url
+    scheme = p.scheme.lower()
+    host = (p.hostname or "").lower()
+    if not host:
+        return url
+    if ":" in host:
+        host = f"[{host}]"
+    if port and port != {"http": 80, "https": 443}.get(scheme):
+        host = f"{host}:{port}"
+    if p.username or p.password:
+        host = p.netloc.rsplit("@", 1)[0] + "@" + host
+    query = "&".join(sorted(q for q in p.query.split("&") if q))
+    return urlunsplit((scheme, host, p.path or "/", query, ""))
+
+
+def unique_urls(urls):
+    """按 canonical_url 去重，保留每个流第一次出现的原地址"""
+    seen = set()
+    out = []
+    for u in urls:
+        if not u:
+            continue
+        key = canonical_url(u)
+        if key not in seen:
+            seen.add(key)
+            out.append(u)
+    return out
+
+
+class ProbeStore:
+    def __init__(self, path=STORE_FILE, max_rows=MAX_ROWS, commit_every=COMMIT_EVERY):
+        self.path = path
+        self.max_rows = max_rows
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # WAL：读不挡写，写事务只在提交的那一刻互斥
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            conn.execute(STATS_SCHEMA)
+            conn.execute(WINNERS_SCHEMA)
+            conn.execute(CANDIDATES_SCHEMA)
+            # 旧版本建的表没有 headroom / fingerprint 列
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(probes)")}
+            if "headroom" not in cols:
+                conn.execute("ALTER TABLE probes ADD COLUMN headroom REAL")
+            if "fingerprint" not in cols:
+                conn.execute("ALTER TABLE probes ADD COLUMN fingerprint TEXT")
+            self._conn = conn
+        return self._conn
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes >= self.commit_every:
+            self._conn.commit()
+            self._writes = 0
+
+    def get(self, url, kind="http", ttl=None, fail_ttl=None):
+        """有效期内的记录返回 dict（latency 为 None 表示上次失败），否则返回 None"""
+        ttl = TTL if ttl is None else ttl
+        fail_ttl = FAIL_TTL if fail_ttl is None else fail_ttl
+        key = canonical_url(url)
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "SELECT latency, status, strict, fallback, headroom, fingerprint, probed_at FROM probes WHERE url=? AND kind=?",
+                    (key, kind),
+                ).fetchone()
+                if row is None:
+                    return None
+                max_age = ttl if row["latency"] is not None else fail_ttl
+                if now - row["probed_at"] > max_age:
+                    return None
+                db.execute("UPDATE probes SET used_at=? WHERE url=? AND kind=?", (now, key, kind))
+                self._wrote()
+                return dict(zip(FIELDS, row))
+        except sqlite3.Error as e:
+            print(f"读取测速记录失败: {e}")
+            return None
+
+    def put(self, url, kind="http", latency=None, status=None, strict=None, fallback=None, headroom=None,
+            fingerprint=None):
+        """
+        记录一次实际测速（latency 为 None 表示失败），同时更新地址和主机的统计。
+        headroom 为实测吞吐与码率之比，fingerprint 为首个分片的内容指纹（HLS 测速才有）。
+        """
+        now = time.time()
+        key = canonical_url(url)
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO probes"
+                    " (url, kind, latency, status, strict, fallback, headroom, fingerprint, probed_at, used_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, latency, status,
+                     None if strict is None else int(strict),
+                     None if fallback is None else int(fallback),
+                     headroom, fingerprint, now, now),
+                )
+                self._record(db, key, kind, latency, now)
+                host = host_of(url)
+                if host:
+                    self._record(db, "host:" + host, kind, latency, now)
+                self._wrote()
+        except sqlite3.Error as e:
+            print(f"保存测速记录失败: {e}")
+
+    def _record(self, db, key, kind, latency, now):
+        row = db.execute(
+            "SELECT n, ewma, fail_rate, recent FROM stats WHERE key=? AND kind=?", (key, kind)
+        ).fetchone()
+        failed = latency is None
+        if row is None:
+            n, ewma, fail_rate, recent = 1, latency, float(failed), []
+        else:
+            n = row["n"] + 1
+            ewma = row["ewma"]
+            if not failed:
+                ewma = latency if ewma is None else ewma + STATS_ALPHA * (latency - ewma)
+            fail_rate = row["fail_rate"] + STATS_ALPHA * (float(failed) - row["fail_rate"])
+            recent = json.loads(row["recent"])
+        if not failed:
+            recent = (recent + [round(latency, 4)])[-RECENT_SAMPLES:]
+        db.execute(
+            "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, n, ewma, fail_rate, json.dumps(recent), now),
+        )
+
+    def _stats(self, key, kind):
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT n, ewma, fail_rate, recent FROM stats WHERE key=? AND kind=?", (key, kind)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        recent = sorted(json.loads(row["recent"]))
+        return {
+            "n": row["n"],
+            "ewma": row["ewma"],
+            "fail_rate": row["fail_rate"],
+            "p50": percentile(recent, 0.5),
+            "p95": percentile(recent, 0.95),
+        }
+
+    def stats(self, url, kind="http"):
+        """地址的历史统计 {n, ewma, fail_rate, p50, p95}，没有记录返回 None"""
+        return self._stats(canonical_url(url), kind)
+
+    def host_stats(self, url, kind="http"):
+        host = host_of(url)
+        return self._stats("host:" + host, kind) if host else None
+
+    def fingerprint(self, url, kind="stream", max_age=FINGERPRINT_TTL):
+        """可信期内最近一次测速记下的内容指纹，没有返回 None"""
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT fingerprint, probed_at FROM probes WHERE url=? AND kind=?", (canonical_url(url), kind)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or time.time() - row["probed_at"] > max_age:
+            return None
+        return row["fingerprint"]
+
+    def winner(self, scope, channel):
+        """上次运行为该频道选中的地址，没有返回 None"""
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT url FROM winners WHERE scope=? AND channel=?", (scope, str(channel))
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row["url"] if row else None
+
+    def set_winner(self, scope, channel, url):
+        try:
+            with self._lock:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO winners VALUES (?, ?, ?, ?)",
+                    (scope, str(channel), url, time.time()),
+                )
+                self._wrote()
+        except sqlite3.Error as e:
+            print(f"保存选中地址失败: {e}")
+
+    def candidates(self, scope, channel):
+        """上次运行为该频道排好序的全部可用地址，没有返回 []"""
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT urls FROM candidates WHERE scope=? AND channel=?", (scope, str(channel))
+                ).fetchone()
+        except sqlite3.Error:
+            return []
+        return json.loads(row["urls"]) if row else []
+
+    def set_candidates(self, scope, channel, urls):
+        try:
+            with self._lock:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?)",
+                    (scope, str(channel), json.dumps(list(urls)), time.time()),
+                )
+                self._wrote()
+        except sqlite3.Error as e:
+            print(f"保存候选地址失败: {e}")
+
+    def timeouts(self, url, default, kind="http"):
+        """
+        按主机历史延迟返回 (连接超时, 读取超时)：快的主机收紧，p95 本来就慢的主机读取超时放宽，
+        连接超时上限为 default，读取超时上限为 default * READ_CEILING
+        """
+        st = self.host_stats(url, kind)
+        if not st or st["n"] < TIMEOUT_MIN_SAMPLES or st["p95"] is None:
+            return default, default
+        connect = min(default, max(CONNECT_FLOOR, st["p50"] * TIMEOUT_FACTOR))
+        read = min(default * READ_CEILING, max(READ_FLOOR, st["p95"] * TIMEOUT_FACTOR))
+        return connect, read
+
+    def score(self, url, kind="http"):
+        """
+        排序分数，越小越好：(EWMA + p50 + p95) / 3 再除以成功率（至少按 10% 算）。
+        地址没有历史时用所在主机的统计；都没有返回 None，从未成功过返回 inf。
+        """
+        st = self.stats(url, kind) or self.host_stats(url, kind)
+        if st is None:
+            return None
+        if st["ewma"] is None:
+            return float("inf")
+        p50 = st["p50"] if st["p50"] is not None else st["ewma"]
+        p95 = st["p95"] if st["p95"] is not None else st["ewma"]
+        return (st["ewma"] + p50 + p95) / 3 / max(1.0 - st["fail_rate"], 0.1)
+
+    def evict(self):
+        """删除过期记录，超出上限时淘汰最久未使用的"""
+        with self._lock:
+            db = self._db()
+            now = time.time()
+            db.execute("DELETE FROM probes WHERE probed_at < ?", (now - STALE_AFTER,))
+            db.execute("DELETE FROM stats WHERE updated_at < ?", (now - STATS_STALE_AFTER,))
+            db.execute("DELETE FROM winners WHERE chosen_at < ?", (now - STATS_STALE_AFTER,))
+            db.execute("DELETE FROM candidates WHERE ranked_at < ?", (now - STATS_STALE_AFTER,))
+            db.execute(
+                "DELETE FROM probes WHERE rowid IN ("
+                "SELECT rowid FROM probes ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+            db.execute(
+                "DELETE FROM stats WHERE rowid IN ("
+                "SELECT rowid FROM stats ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+            db.commit()
+
+    def flush(self):
+        """提交未落盘的写入；常驻进程定期调用，其他脚本才能看到最新结果"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._writes = 0
+
+    def close(self):
+        if self._conn is None:
+            return
+        try:
+            self.evict()
+        except sqlite3.Error as e:
+            print(f"整理测速记录失败: {e}")
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+
+STORE = ProbeStore()
+atexit.register(STORE.close)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共用的异步测速引擎
+
+joker / merge_ee / merge_ff 以前各自带一份 check() + pick_best()：每个频道新建一个
+ThreadPoolExecutor(max_workers=5)，requests.get(stream=True) 不走连接池，响应也从不关闭。
+现在所有脚本共用一个后台事件循环 + 一个 aiohttp 会话：
+
+- 全局并发上限 + 单主机并发上限 + 单主机令牌桶限速（rate_limit.HostScheduler），
+  计时从拿到名额之后开始，排队时间不算进延迟
+- 连接池复用，短响应读完归还连接，直播流只读响应头后立即关闭
+- 一次提交所有频道的全部候选地址；同一个流（按 canonical_url 判断，不同频道名/分组下
+  出现的同一地址也算）本次运行只测一次，结果分发给所有用到它的频道，
+  结果同时写进 probe_store，有效期内的下一次运行直接复用
+
+pick_best_many() 等所有候选测完再选最快的；race_many() 是抢答模式：第一个在阈值内响应的
+候选直接胜出，其余探测立即取消，一个黑洞地址不会再让每个频道都等满超时。
+可选的 hedge 延迟让候选依次错开启动，前面的候选足够快时后面的根本不发请求。
+排名和抢答的启动顺序都参考 probe_store 里的历史统计，而不是只看这一次的延迟。
+
+sticky_many() 是热启动模式：先只验证上次选中的地址，健康就直接沿用；
+以 EXPLORE_RATE 的概率再按 UCB 挑一个其他候选复测，更好就换掉。
+大部分频道每次运行只需要测一个地址。
+
+with_failover() 把每个频道的选中地址扩展成按排名排列的前 FAILOVER_URLS 个可用地址，
+生成脚本连续输出这几条，选中的地址在两次运行之间失效时播放器可以直接切到下一条。
+"""
+
+import os
+import math
+import time
+import random
+import atexit
+import asyncio
+import threading
+
+import aiohttp
+
+from probe_store import STORE, canonical_url, unique_urls
+from reachability import reachable, CONNECT_TIMEOUT
+from stream_probes import supports, probe_stream
+from rate_limit import HostScheduler, MAX_CONCURRENCY, HOST_CONCURRENCY
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+# 单个地址测速超时（秒），只等到响应头；有主机历史时按 STORE.timeouts() 调整（快的主机收紧，慢的主机放宽）
+TIMEOUT = 5
+# Content-Length 不超过这个大小的响应读完再归还连接，便于复用
+REUSE_BODY_LIMIT = 64 * 1024
+# 抢答模式：响应时间不超过这个值（秒）的候选直接胜出
+RACE_THRESHOLD = 1.0
+# 抢答模式：每隔多少秒追加启动一个备用候选（None 表示全部同时启动）
+HEDGE_DELAY = 0.3
+# 热启动模式：上次选中的地址健康时，以这个概率再复测一个其他候选
+EXPLORE_RATE = 0.1
+# UCB 探索系数（秒）：测得少的候选分数按 UCB_C * sqrt(ln N / n) 打折
+UCB_C = 0.5
+# 每个频道输出的地址数：1 为只输出选中的地址，大于 1 时按排名连续输出前 N 个可用地址
+FAILOVER_URLS = max(1, int(os.environ.get("FAILOVER_URLS", 1)))
+
+
+class ProbeEngine:
+    """在后台线程的事件循环里执行测速，同步代码通过 probe_many() 等函数提交任务"""
+
+    def __init__(self, limit=MAX_CONCURRENCY, per_host=HOST_CONCURRENCY, timeout=TIMEOUT):
+        self.limit = limit
+        self.per_host = per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._session = None
+        self._scheduler = None
+        # 本次运行已测完的结果 / 正在测的 [Task, 引用数]，均按 canonical_url 索引
+        self._results = {}
+        self._inflight = {}
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="prober", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _setup(self):
+        self._scheduler = HostScheduler(self.limit, self.per_host)
+        connector = aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(connector=connector, headers=HEADERS)
+
+    async def _probe(self, url):
+        """
+        返回响应头到达的耗时（秒），非 200 或出错返回 None；有效期内测过的地址直接用 STORE 里的结果，
+        TCP 预检连不上的地址不再发 HTTP 请求
+        """
+        cached = STORE.get(url)
+        if cached is not None:
+            return cached["latency"]
+        if not await reachable(url, STORE.timeouts(url, CONNECT_TIMEOUT)[0]):
+            STORE.put(url)
+            return None
+        latency, status = await self._probe_http(url)
+        STORE.put(url, latency=latency, status=status)
+        return latency
+
+    async def _probe_http(self, url):
+        """返回 (延迟, HTTP 状态)，连接失败时状态为 None；rtsp/rtmp 地址改用协议探测"""
+        async with self._scheduler.slot(url):
+            if supports(url):
+                return await probe_stream(url, self.timeout)
+            start = time.time()
+            try:
+                connect, read = STORE.timeouts(url, self.timeout)
+                timeout = aiohttp.ClientTimeout(total=max(self.timeout, read), sock_connect=connect, sock_read=read)
+                async with self._session.get(url, timeout=timeout) as r:
+                    if r.status != 200:
+                        return None, r.status
+                    latency = time.time() - start
+                    if r.content_length is not None and r.content_length <= REUSE_BODY_LIMIT:
+                        await r.read()
+                    return latency, r.status
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                return None, None
+
+    async def _probe_once(self, url):
+        """同一个流本次运行只测一次：并发的调用共享同一个探测，所有调用方都取消后探测才取消"""
+        key = canonical_url(url)
+        if key in self._results:
+            return self._results[key]
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = self._inflight[key] = [asyncio.ensure_future(self._probe(url)), 0]
+        task = entry[0]
+        entry[1] += 1
+        try:
+            latency = await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                if not task.done():
+                    task.cancel()
+        self._results[key] = latency
+        return latency
+
+    async def _probe_all(self, urls):
+        results = await asyncio.gather(*(self._probe_once(u) for u in urls), return_exceptions=True)
+        return {u: (None if isinstance(r, BaseException) else r) for u, r in zip(urls, results)}
+
+    async def _race(self, urls, threshold, hedge):
+        """
+        返回 (url, 延迟)：第一个不超过 threshold 的成功候选；都超过时取已完成中排名最好的；
+        全失败为 (None, None)。候选按历史分数排序后依次启动，历来稳定的地址先上。
+        """
+        queue = sorted(unique_urls(urls), key=self._launch_order)
+        tasks = {}
+        pending = set()
+        best, best_t, best_r = None, None, None
+
+        def launch():
+            u = queue.pop(0)
+            t = asyncio.ensure_future(self._probe_once(u))
+            tasks[t] = u
+            pending.add(t)
+
+        try:
+            if hedge is None:
+                while queue:
+                    launch()
+            elif queue:
+                launch()
+            while pending or queue:
+                if not pending:
+                    launch()
+                timeout = hedge if hedge is not None and queue else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # hedge 到时还没有结果，追加一个备用候选
+                    launch()
+                    continue
+                for t in done:
+                    latency = t.result()
+                    if latency is None:
+                        if queue:
+                            launch()
+                        continue
+                    if latency <= threshold:
+                        return tasks[t], latency
+                    r = rank(tasks[t], latency)
+                    if best_r is None or r < best_r:
+                        best, best_t, best_r = tasks[t], latency, r
+            return best, best_t
+        finally:
+            for t in pending:
+                t.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def _challenger(self, urls):
+        """UCB：从没测过的候选优先，否则取 score - UCB_C * sqrt(ln N / n) 最小的"""
+        counts = {}
+        for u in urls:
+            st = STORE.stats(u)
+            if not st:
+                return u
+            counts[u] = st["n"]
+        total = sum(counts.values())
+        return min(urls, key=lambda u: STORE.score(u) - UCB_C * math.sqrt(math.log(total) / counts[u]))
+
+    async def _sticky(self, urls, prev, threshold, hedge, explore):
+        urls = unique_urls(urls)
+        prev_key = canonical_url(prev) if prev else None
+        prev = next((u for u in urls if canonical_url(u) == prev_key), None)
+        if prev is not None:
+            latency = await self._probe_once(prev)
+            if latency is not None and latency <= threshold:
+                others = [u for u in urls if u != prev]
+                if not others or random.random() >= explore:
+                    return prev, latency
+                challenger = self._challenger(others)
+                c_latency = await self._probe_once(challenger)
+                if c_latency is not None and rank(challenger, c_latency) < rank(prev, latency):
+                    return challenger, c_latency
+                return prev, latency
+        return await self._race(urls, threshold, hedge)
+
+    async def _sticky_all(self, candidates, winners, threshold, hedge, explore):
+        keys = list(candidates)
+        results = await asyncio.gather(
+            *(self._sticky(candidates[k], winners.get(k), threshold, hedge, explore) for k in keys)
+        )
+        return dict(zip(keys, results))
+
+    def sticky_many(self, scope, candidates, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY, explore=EXPLORE_RATE):
+        """
+        热启动选源：scope 区分不同的生成脚本，candidates 的 key 即频道；
+        返回 {key: (url, 延迟)}，并把选中的地址记为下次运行的起点
+        """
+        if not candidates:
+            return {}
+        winners = {k: STORE.winner(scope, k) for k in candidates}
+        loop = self._ensure_loop()
+        results = asyncio.run_coroutine_threadsafe(
+            self._sticky_all(candidates, winners, threshold, hedge, explore), loop
+        ).result()
+        for key, (url, _) in results.items():
+            if url:
+                STORE.set_winner(scope, key, url)
+        return results
+
+    def _launch_order(self, url):
+        """没有历史的地址按超时时间排，排在历史较好的后面、从未成功的前面"""
+        score = STORE.score(url)
+        return self.timeout if score is None else score
+
+    async def _race_all(self, candidates, threshold, hedge):
+        keys = list(candidates)
+        results = await asyncio.gather(*(self._race(candidates[k], threshold, hedge) for k in keys))
+        return dict(zip(keys, results))
+
+    def race_many(self, candidates, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY):
+        """candidates: {key: [url, ...]}，每个 key 各自抢答，返回 {key: (url, 延迟)}，全失败为 (None, None)"""
+        if not candidates:
+            return {}
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._race_all(candidates, threshold, hedge), loop).result()
+
+    def probe_many(self, urls):
+        """批量测速，返回 {url: 延迟或 None}；规范化后相同的地址只测一次，结果分发给每个原地址"""
+        urls = list(dict.fromkeys(u for u in urls if u))
+        if not urls:
+            return {}
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._probe_all(urls), loop).result()
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+
+
+ENGINE = ProbeEngine()
+atexit.register(ENGINE.close)
+
+
+def probe_many(urls):
+    return ENGINE.probe_many(urls)
+
+
+def rank(url, latency):
+    """排序用的分数：有历史统计时用 STORE.score（EWMA/p50/p95/失败率），否则用本次延迟"""
+    score = STORE.score(url)
+    return latency if score is None else score
+
+
+def ranked_urls(urls, latencies):
+    """本次测速成功的地址按分数从好到差排列；分数相同时保持候选顺序"""
+    ok = [(rank(u, latencies[u]), i, u) for i, u in enumerate(urls) if latencies.get(u) is not None]
+    return [u for _, _, u in sorted(ok)]
+
+
+def best_ranked(urls, latencies):
+    """本次测速成功的地址里取分数最好的，全部失败返回 None"""
+    ranked = ranked_urls(urls, latencies)
+    return ranked[0] if ranked else None
+
+
+def pick_best_many(candidates):
+    """candidates: {key: [url, ...]}，所有候选一次提交测速，返回 {key: 排名最好的 url 或 None}"""
+    latencies = probe_many(u for urls in candidates.values() for u in urls)
+    return {key: best_ranked(urls, latencies) for key, urls in candidates.items()}
+
+
+def pick_best(urls):
+    return pick_best_many({None: urls})[None]
+
+
+def race_many(candidates, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY):
+    return ENGINE.race_many(candidates, threshold, hedge)
+
+
+def race_best_many(candidates, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY):
+    """抢答模式的 pick_best_many：返回 {key: 胜出的 url 或 None}"""
+    return {key: url for key, (url, _) in race_many(candidates, threshold, hedge).items()}
+
+
+def sticky_many(scope, candidates, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY, explore=EXPLORE_RATE):
+    return ENGINE.sticky_many(scope, candidates, threshold, hedge, explore)
+
+
+def sticky_best_many(scope, candidates, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY, explore=EXPLORE_RATE):
+    """热启动模式的 pick_best_many：返回 {key: 选中的 url 或 None}"""
+    return {key: url for key, (url, _) in sticky_many(scope, candidates, threshold, hedge, explore).items()}
+
+
+def with_failover(best_map, candidates, n=FAILOVER_URLS):
+    """
+    {key: 选中的 url 或 None} 扩展成 {key: [url, ...]}：选中的地址排第一，后面按排名补上
+    其他测速成功的候选，最多 n 个（有效期内的测速记录直接复用）；n 为 1 时不额外测速
+    """
+    result = {key: [url] if url else [] for key, url in best_map.items()}
+    if n <= 1:
+        return result
+    rest = {}
+    for key, url in best_map.items():
+        if url:
+            chosen = canonical_url(url)
+            rest[key] = [u for u in unique_urls(candidates[key]) if canonical_url(u) != chosen]
+    latencies = probe_many(u for urls in rest.values() for u in urls)
+    for key, urls in rest.items():
+        result[key] += ranked_urls(urls, latencies)[:n - 1]
+    return result
+
+
+def sticky_failover_many(scope, candidates, n=FAILOVER_URLS, threshold=RACE_THRESHOLD, hedge=HEDGE_DELAY,
+                         explore=EXPLORE_RATE):
+    """热启动选源 + 备用地址：返回 {key: [选中的 url, 备用 url, ...]}，全部失败为 []"""
+    return with_failover(sticky_best_many(scope, candidates, threshold, hedge, explore), candidates, n)
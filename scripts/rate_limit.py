@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按主机限速的测速调度
+
+每个主机一个令牌桶（每秒补充 rate 个、最多攒 burst 个）加一个并发上限，外面再套全局并发上限。
+拿令牌和主机名额时不占全局名额，所以某个中转主机（tv.iill.top、v.iill.top 等）被限住时，
+其他主机的探测照常进行，不同主机的请求自然交错，单个主机的压力始终有上限，
+不会再因为突发请求被对方限流、误判成失败。
+
+令牌桶在线程之间共享（build_all 里 prober 的后台事件循环和 new.py 的事件循环同时在跑），
+并发名额每个事件循环各一份。
+"""
+
+import time
+import asyncio
+import threading
+import contextlib
+import weakref
+
+from host_health import host_of
+
+# 全局同时进行的探测数
+MAX_CONCURRENCY = 32
+# 单个主机：同时进行的探测数、每秒新发起的探测数、允许的突发数
+HOST_CONCURRENCY = 4
+HOST_RATE = 5.0
+HOST_BURST = 5
+# 容易限流的主机单独设置 (每秒, 突发)
+HOST_OVERRIDES = {
+    "tv.iill.top": (2.0, 2),
+    "v.iill.top": (2.0, 2),
+}
+
+
+class TokenBucket:
+    """预约式令牌桶：令牌可以透支，透支多少就等多久，先来的先发，线程安全"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """取一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def take(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(host):
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            rate, burst = HOST_OVERRIDES.get(host, (HOST_RATE, HOST_BURST))
+            bucket = _buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+
+class HostScheduler:
+    """一个事件循环内的调度器：主机并发名额 -> 主机令牌 -> 全局名额"""
+
+    def __init__(self, limit=MAX_CONCURRENCY, per_host=HOST_CONCURRENCY):
+        self.per_host = per_host
+        self._sem = asyncio.Semaphore(limit)
+        self._host_sems = {}
+
+    def _host_sem(self, host):
+        sem = self._host_sems.get(host)
+        if sem is None:
+            sem = self._host_sems[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url):
+        host = host_of(url)
+        async with self._host_sem(host):
+            await bucket_for(host).take()
+            async with self._sem:
+                yield
+
+
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def scheduler():
+    """当前事件循环的调度器"""
+    loop = asyncio.get_running_loop()
+    sched = _schedulers.get(loop)
+    if sched is None:
+        sched = _schedulers[loop] = HostScheduler()
+    return sched
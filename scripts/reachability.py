@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测速前的 TCP 连通性预检
+
+聚合列表里很多候选的主机根本解析不了或者直接拒绝连接，以前要完整发一次 HTTP 请求
+（https 还要握手 TLS）才知道。这里先异步解析 DNS（本次运行按主机缓存），再对每个不同的
+host:port 做一次非阻塞 TCP 连接，连不上的候选直接判失败，不再进入 HTTP / HLS 测速。
+"""
+
+import socket
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+from single_flight import SingleFlight
+
+# TCP 连接超时（秒）
+CONNECT_TIMEOUT = 3
+# 每个主机最多尝试的地址数（IPv4/IPv6 多个 A 记录）
+MAX_ADDRS = 2
+
+DEFAULT_PORTS = {"http": 80, "https": 443, "rtsp": 554, "rtmp": 1935}
+
+_lock = threading.Lock()
+# 已完成的结果，跨事件循环共享：(host, port) -> 地址列表 / 是否可连
+_resolved = {}
+_reachable = {}
+_dns = SingleFlight()
+_tcp = SingleFlight()
+
+
+def endpoint_of(url):
+    """(host, port)，解析不了返回 None"""
+    try:
+        p = urlsplit(url)
+        port = p.port or DEFAULT_PORTS.get(p.scheme.lower())
+    except ValueError:
+        return None
+    if not p.hostname or not port:
+        return None
+    return p.hostname.lower(), port
+
+
+async def _getaddrinfo(host, port):
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, OSError, UnicodeError):
+        return []
+    return list(dict.fromkeys(info[4][:2] for info in infos))[:MAX_ADDRS]
+
+
+async def resolve(host, port):
+    """DNS 解析，本次运行同一个主机只解析一次；失败返回 []"""
+    key = (host, port)
+    with _lock:
+        if key in _resolved:
+            return _resolved[key]
+    addrs = await _dns.do_async(key, _getaddrinfo, host, port)
+    with _lock:
+        _resolved[key] = addrs
+    return addrs
+
+
+async def _connect(host, port, timeout):
+    for addr, addr_port in await resolve(host, port):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(addr, addr_port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            continue
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+        return True
+    return False
+
+
+def reset():
+    """清掉已缓存的 DNS 和连通性结果；常驻进程（monitor.py）每轮开始时调用，主机恢复、DNS 变更才能被发现"""
+    with _lock:
+        _resolved.clear()
+        _reachable.clear()
+    _dns.clear()
+    _tcp.clear()
+
+
+def forget(url):
+    """只清掉这个地址所在 host:port 的连通性结果，下次 reachable 重新连接"""
+    ep = endpoint_of(url)
+    with _lock:
+        _reachable.pop(ep, None)
+    _tcp.forget(ep)
+
+
+async def reachable(url, timeout=CONNECT_TIMEOUT):
+    """能建立 TCP 连接返回 True；同一个 host:port 本次运行只检查一次。地址解析不了的 URL 交给后续测速处理"""
+    ep = endpoint_of(url)
+    if ep is None:
+        return True
+    with _lock:
+        if ep in _reachable:
+            return _reachable[ep]
+    ok = await _tcp.do_async(ep, _connect, ep[0], ep[1], timeout)
+    with _lock:
+        _reachable[ep] = ok
+    return ok
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内请求合并（single-flight）
+
+同一个 URL 在一次运行中只下载一次：并发的调用等待同一个下载完成，
+之后的重复调用直接拿缓存结果。解析结果同样按 (URL, 解析函数) 缓存，
+例如 MyIPTV.m3u 同时被 load_extra() 和 load_chc_from_shanghai() 使用时只下载、解析一次。
+"""
+
+import asyncio
+import functools
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同一个 key 只执行一次 fn，其余调用等待并共享结果；异常不缓存"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self._calls.pop(key, None)
+            finally:
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """asyncio 版本：fn 为协程函数，同一事件循环内共享同一个 Task"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get((id(loop), key))
+            if task is None:
+                task = loop.create_task(fn(*args, **kwargs))
+                self._tasks[(id(loop), key)] = task
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            with self._lock:
+                if self._tasks.get((id(loop), key)) is task:
+                    del self._tasks[(id(loop), key)]
+            raise
+
+    def forget(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+            for k in [k for k in self._tasks if k[1] == key]:
+                del self._tasks[k]
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+            self._tasks.clear()
+
+
+# 全局共享：同一进程里的所有脚本共用
+DOWNLOADS = SingleFlight()
+PARSED = SingleFlight()
+# 测速结果表，key 为 (测速类型, URL)：new.py 的 test_stream 同一个流本次运行只测一次；
+# ("origin", 频道, 内容指纹) 为同源镜像的代表测速
+PROBES = SingleFlight()
+
+
+def shared_download(fn):
+    """装饰 download(url, ...)：同一 URL 只真正下载一次"""
+    @functools.wraps(fn)
+    def wrapper(url, *args, **kwargs):
+        return DOWNLOADS.do(url, fn, url, *args, **kwargs)
+    return wrapper
+
+
+def shared_probe(fn):
+    """装饰 check(url)：同一播放地址本次运行只测一次"""
+    @functools.wraps(fn)
+    def wrapper(url, *args, **kwargs):
+        return PROBES.do((fn.__name__, url), fn, url, *args, **kwargs)
+    return wrapper
+
+
+def fetch_once(url, download, *args, **kwargs):
+    """不方便用装饰器时（例如类方法）直接调用"""
+    return DOWNLOADS.do(url, download, url, *args, **kwargs)
+
+
+def parse_once(url, raw, parse):
+    """同一 URL 用同一解析函数只解析一次，返回列表副本，调用方可以随意修改"""
+    if not raw:
+        return []
+    return list(PARSED.do((url, parse), parse, raw))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+订阅源并发加载
+
+所有订阅源同时发起下载（信号量限制并发数），每个源下载完成后立即解析，
+单个慢源（例如 175.178.251.183:6689）不再拖慢整个任务。
+返回结果保持传入 URL 的顺序，保证生成的播放列表稳定。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 同时下载的订阅源数量上限
+MAX_CONCURRENCY = 6
+
+
+def load_sources(urls, download, parse, limit=MAX_CONCURRENCY):
+    """
+    并发下载 urls 并逐个解析
+
+    download(url) -> 内容（失败返回空）
+    parse(url, content) -> 解析结果，只对下载成功的源调用
+    返回 [(url, 解析结果)]，下载失败或解析异常的源结果为 None
+    """
+    urls = [u for u in urls if u]
+    if not urls:
+        return []
+
+    sem = threading.Semaphore(max(1, limit))
+    results = {}
+
+    def worker(url):
+        with sem:
+            raw = download(url)
+        if not raw:
+            return url, None
+        return url, parse(url, raw)
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as ex:
+        futures = [ex.submit(worker, u) for u in urls]
+        for f in as_completed(futures):
+            try:
+                url, parsed = f.result()
+            except Exception as e:
+                print(f"源处理失败: {e}")
+                continue
+            results[url] = parsed
+
+    return [(u, results.get(u)) for u in urls]
+
+
+async def load_sources_async(urls, fetch, handle, limit=MAX_CONCURRENCY):
+    """
+    asyncio 版本：fetch(url) 在信号量内执行，handle(url, content) 在下载完成后立即执行
+
+    handle 可以继续做测速等耗时工作，不占用下载并发名额。
+    返回 [(url, handle 结果)]，保持 urls 顺序
+    """
+    urls = [u for u in urls if u]
+    sem = asyncio.Semaphore(max(1, limit))
+    results = {}
+
+    async def run(url):
+        async with sem:
+            raw = await fetch(url)
+        if not raw:
+            return
+        results[url] = await handle(url, raw)
+
+    outcomes = await asyncio.gather(*(run(u) for u in urls), return_exceptions=True)
+    for url, outcome in zip(urls, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"源处理失败: {url} ({outcome})")
+
+    return [(u, results.get(u)) for u in urls]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RTSP / RTMP 的轻量存活探测
+
+auto.py 接受 rtsp:// 和 rtmp:// 地址，但以前用 requests 测速，这类地址必然失败，
+只能被丢掉或者不测就选。这里直接用 asyncio 套接字说协议：
+
+- RTSP：OPTIONS 之后再 DESCRIBE，DESCRIBE 返回 200 才算可用
+- RTMP：完成 C0/C1 -> S0/S1/S2 -> C2 握手（只能说明服务在线，不校验具体流名）
+
+返回 (延迟, 状态码)，失败时延迟为 None，和 prober 的 HTTP 探测接口一致。
+"""
+
+import os
+import time
+import asyncio
+from urllib.parse import urlsplit
+
+USER_AGENT = "Mozilla/5.0"
+RTSP_PORT = 554
+RTMP_PORT = 1935
+RTMP_VERSION = 3
+RTMP_HANDSHAKE_SIZE = 1536
+
+
+async def _read_rtsp_response(reader):
+    """读一个 RTSP 响应（状态行 + 头，按 Content-Length 丢弃正文），返回状态码"""
+    status_line = await reader.readline()
+    parts = status_line.decode("latin-1").split()
+    if len(parts) < 2 or not parts[0].startswith("RTSP/"):
+        return None
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line or line in (b"\r\n", b"\n"):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip() or 0)
+    if length:
+        await reader.readexactly(length)
+    try:
+        return int(parts[1])
+    except ValueError:
+        return None
+
+
+async def _rtsp(url):
+    p = urlsplit(url)
+    reader, writer = await asyncio.open_connection(p.hostname, p.port or RTSP_PORT)
+    try:
+        start = time.time()
+        for cseq, method, extra in ((1, "OPTIONS", ""), (2, "DESCRIBE", "Accept: application/sdp\r\n")):
+            writer.write(
+                f"{method} {url} RTSP/1.0\r\nCSeq: {cseq}\r\nUser-Agent: {USER_AGENT}\r\n{extra}\r\n".encode()
+            )
+            await writer.drain()
+            status = await _read_rtsp_response(reader)
+            if status != 200:
+                return None, status
+        return time.time() - start, status
+    finally:
+        writer.close()
+
+
+async def _rtmp(url):
+    p = urlsplit(url)
+    reader, writer = await asyncio.open_connection(p.hostname, p.port or RTMP_PORT)
+    try:
+        start = time.time()
+        c1 = bytes(4) + bytes(4) + os.urandom(RTMP_HANDSHAKE_SIZE - 8)
+        writer.write(bytes([RTMP_VERSION]) + c1)
+        await writer.drain()
+        s0 = await reader.readexactly(1)
+        if s0[0] != RTMP_VERSION:
+            return None, None
+        s1 = await reader.readexactly(RTMP_HANDSHAKE_SIZE)
+        latency = time.time() - start
+        await reader.readexactly(RTMP_HANDSHAKE_SIZE)
+        writer.write(s1)
+        await writer.drain()
+        return latency, 200
+    finally:
+        writer.close()
+
+
+PROTOCOL_PROBES = {"rtsp": _rtsp, "rtmp": _rtmp}
+
+
+def supports(url):
+    return urlsplit(url).scheme.lower() in PROTOCOL_PROBES
+
+
+async def probe_stream(url, timeout):
+    """按协议探测，返回 (延迟或 None, 状态码或 None)"""
+    probe = PROTOCOL_PROBES[urlsplit(url).scheme.lower()]
+    try:
+        return await asyncio.wait_for(probe(url), timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        return None, None
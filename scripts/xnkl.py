@@ -17,8 +17,13 @@ xnkl.m3u 直播源分类脚本
 import requests
 import re
 import os
+import time
 from datetime import datetime
 
+from single_flight import shared_download
+from host_health import REGISTRY
+from playlist_stream import stream_channels
+
 # ================== 配置区域 ==================
 
 # 原始直播源URL - 已更新为你指定的地址
@@ -86,8 +91,12 @@ def log(msg):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
 
 
+@shared_download
 def download_source(url, desc):
-    """下载源文件，增加对 workers.dev 的特殊处理"""
+    """边下载边解析源文件，返回频道记录列表，增加对 workers.dev 的特殊处理"""
+    if not REGISTRY.allow(url):
+        log(f"⏭ {desc} 主机处于熔断状态，跳过")
+        return None
     try:
         log(f"📥 下载 {desc}...")
         headers = {
@@ -96,26 +105,36 @@ def download_source(url, desc):
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
         }
         # 对于 workers.dev 可能需要禁用 SSL 验证或增加超时
-        r = requests.get(url, timeout=30, headers=headers)
-        r.encoding = 'utf-8'
-        r.raise_for_status()
+        start = time.time()
+        channels = list(stream_channels(url, headers=headers, timeout=30))
+        REGISTRY.record_success(url, time.time() - start)
         
         # 检查返回内容是否有效
-        content = r.text
-        if len(content.strip()) == 0:
+        if not channels:
             log(f"⚠️ {desc} 返回内容为空")
             return None
             
-        log(f"✅ {desc} 下载成功 ({len(content)} 字符)")
-        return content
+        log(f"✅ {desc} 下载成功 ({len(channels)} 个条目)")
+        return channels
         
     except requests.exceptions.SSLError as e:
+        REGISTRY.record_failure(url)
         log(f"❌ {desc} SSL错误: {e}")
         return None
     except requests.exceptions.Timeout:
+        REGISTRY.record_failure(url)
         log(f"❌ {desc} 下载超时")
         return None
+    except requests.exceptions.HTTPError as e:
+        # 5xx 计入主机失败，4xx 说明主机在线，只是资源有问题
+        if e.response is None or e.response.status_code >= 500:
+            REGISTRY.record_failure(url)
+        else:
+            REGISTRY.record_success(url, time.time() - start)
+        log(f"❌ {desc} 下载失败: {e}")
+        return None
     except requests.exceptions.RequestException as e:
+        REGISTRY.record_failure(url)
         log(f"❌ {desc} 下载失败: {e}")
         return None
     except Exception as e:
@@ -206,36 +225,9 @@ def deduplicate_channels(channels):
     return deduped
 
 
-def parse_m3u(content):
-    """解析M3U内容，提取频道信息"""
-    channels = []
-    lines = content.splitlines()
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # 兼容处理：有些文件可能以 #EXTINF 开头，有些可能直接是 "频道名,URL" 格式
-        if line.startswith('#EXTINF:'):
-            info_line = line
-            if i + 1 < len(lines):
-                url_line = lines[i + 1].strip()
-                if url_line and (url_line.startswith('http://') or url_line.startswith('https://')):
-                    channel_name_match = re.search(r',([^,]+)$', info_line)
-                    if channel_name_match:
-                        channel_name = channel_name_match.group(1).strip()
-                    else:
-                        channel_name = info_line
-                    channels.append((channel_name, url_line))
-                    i += 1
-        elif ',' in line and '://' in line:
-            # 处理 "频道名,URL" 格式
-            parts = line.split(',', 1)
-            if len(parts) == 2 and (parts[1].startswith('http://') or parts[1].startswith('https://')):
-                channels.append((parts[0].strip(), parts[1].strip()))
-        
-        i += 1
-    
+def parse_m3u(records):
+    """从解析好的频道记录中提取 (频道名, URL)（兼容 "频道名,URL" 格式）"""
+    channels = [(c.name, c.url) for c in records if c.name]
     log(f"📊 解析到 {len(channels)} 个频道")
     return channels
 
@@ -307,12 +299,12 @@ def main():
     log(f"📄 输出文件: {output_path}")
     log(f"🌐 源地址: {SOURCE_URL}")
 
-    content = download_source(SOURCE_URL, "xnkl.txt")
-    if not content:
+    records = download_source(SOURCE_URL, "xnkl.txt")
+    if not records:
         log("❌ 下载失败，程序退出")
         return 1
 
-    raw_channels = parse_m3u(content)
+    raw_channels = parse_m3u(records)
     if not raw_channels:
         log("❌ 没有解析到任何频道，程序退出")
         return 1